@@ -0,0 +1,66 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import select, func, case
+from sqlalchemy.orm import Session
+
+from models import SavedPost, PostTag, Reminder, PlatformEnum
+
+# Aggregate-only queries behind /analytics/ and the user_stats rebuild.
+# Everything here returns plain rows; no ORM objects are loaded.
+
+
+def post_aggregates(db: Session, user_id: int) -> Dict[str, object]:
+    """Post totals per platform and the ai_detected count in one GROUP BY pass"""
+    by_platform = {platform.value: 0 for platform in PlatformEnum}
+    total = ai_detected = 0
+    for platform, count, detected in db.execute(
+        select(
+            SavedPost.platform,
+            func.count(),
+            func.sum(case((SavedPost.ai_detected == True, 1), else_=0)),
+        )
+        .where(SavedPost.user_id == user_id)
+        .group_by(SavedPost.platform)
+    ):
+        total += count
+        ai_detected += detected or 0
+        if platform is not None:
+            by_platform[platform.value] = count
+    return {"posts_by_platform": by_platform, "total_posts": total, "ai_detected_posts": ai_detected}
+
+
+def tag_aggregates(db: Session, user_id: int) -> Dict[str, int]:
+    """Post count per tag, grouped on the (user_id, tag) index"""
+    return dict(db.execute(
+        select(PostTag.tag, func.count())
+        .where(PostTag.user_id == user_id)
+        .group_by(PostTag.tag)
+        .order_by(PostTag.tag)
+    ).all())
+
+
+def reminder_aggregates(db: Session, user_id: int, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Active, completed and upcoming reminder counts in a single scan"""
+    now = now or datetime.utcnow()
+    active, completed, upcoming = db.execute(
+        select(
+            func.count().filter(Reminder.is_completed == False),
+            func.count().filter(Reminder.is_completed == True),
+            func.count().filter(Reminder.is_completed == False, Reminder.due_date > now),
+        )
+        .where(Reminder.user_id == user_id)
+    ).one()
+    return {"active_reminders": active, "completed_reminders": completed, "upcoming_deadlines": upcoming}
+
+
+def upcoming_deadline_count(db: Session, user_id: int, now: Optional[datetime] = None) -> int:
+    now = now or datetime.utcnow()
+    return db.execute(
+        select(func.count())
+        .where(
+            Reminder.user_id == user_id,
+            Reminder.is_completed == False,
+            Reminder.due_date > now,
+        )
+    ).scalar()
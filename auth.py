@@ -0,0 +1,155 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import stats as user_stats
+from models import User, ApiToken
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Invalidation only reaches this process; serve.py caps this with several workers
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
+# Opt-in for local demos: requests without a bearer token act as the demo account
+AUTH_DEMO_FALLBACK = os.getenv("AUTH_DEMO_FALLBACK", "0") == "1"
+AUTH_DEMO_EMAIL = os.getenv("AUTH_DEMO_EMAIL", "demo@stashapp.com")
+
+DEMO_KEY = "demo"
+
+
+@dataclass(frozen=True)
+class Identity:
+    """Detached snapshot of a User, safe to share between requests"""
+    id: int
+    email: str
+    name: str
+    created_at: datetime
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user) -> "Identity":
+        return cls(
+            id=user.id, email=user.email, name=user.name,
+            created_at=user.created_at, is_active=bool(user.is_active)
+        )
+
+
+class IdentityCache:
+    """Bounded LRU of identities with a TTL, indexed by user for invalidation"""
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Identity]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            identity, expires_at = entry
+            if expires_at < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return identity
+
+    def put(self, key: str, identity: Identity) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (identity, time.monotonic() + self.ttl)
+            self._keys_by_user.setdefault(identity.id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[0].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[0].id]
+
+
+identity_cache = IdentityCache()
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_token(db: Session, user_id: int) -> str:
+    """Create a bearer token for the user; only its hash is stored. The caller commits"""
+    token = new_token()
+    db.add(ApiToken(token_hash=hash_token(token), user_id=user_id))
+    return token
+
+
+def lookup_token(db: Session, token_hash: str) -> Optional[Identity]:
+    user = db.execute(
+        select(User).join(ApiToken).where(ApiToken.token_hash == token_hash)
+    ).scalar()
+    return Identity.from_user(user) if user else None
+
+
+def lookup_demo_user(db: Session) -> Identity:
+    """The demo account (AUTH_DEMO_EMAIL), created if it does not exist yet"""
+    user = db.execute(select(User).where(User.email == AUTH_DEMO_EMAIL)).scalar()
+    if not user:
+        user = User(email=AUTH_DEMO_EMAIL, name="Demo User")
+        db.add(user)
+        db.flush()
+        user_stats.init_user_stats(db, user.id)
+        db.commit()
+    return Identity.from_user(user)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Issue bearer tokens for existing users")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    issue_parser = subcommands.add_parser("issue", help="print a new token for a user")
+    issue_parser.add_argument("--email", required=True)
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        user_id = db.execute(select(User.id).where(User.email == args.email)).scalar()
+        if user_id is None:
+            raise SystemExit(f"No user with email {args.email}")
+        token = issue_token(db, user_id)
+        db.commit()
+        print(token)
+    finally:
+        db.close()
@@ -0,0 +1,282 @@
+"""Endpoint scenarios and the in-process measurement loop
+
+Imported by run.py inside a worker process whose DATABASE_URL already points
+at the benchmark database, so `main` binds to it on import.
+"""
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    raise SystemExit("The benchmarks need httpx: pip install 'httpx<0.28'")
+
+from sqlalchemy import event
+
+
+@dataclass
+class State:
+    """Ids and cursors shared between scenarios of one run"""
+    run_id: str
+    cursor: Optional[str] = None
+    created_posts: List[int] = field(default_factory=list)
+    created_reminders: List[int] = field(default_factory=list)
+    counter: int = 0
+
+    def next(self) -> int:
+        self.counter += 1
+        return self.counter
+
+
+Send = Callable[[httpx.AsyncClient, State, int], Awaitable[httpx.Response]]
+
+
+@dataclass
+class Scenario:
+    name: str
+    send: Send
+    # Read-only and safe to run many at once in the throughput phase
+    concurrent: bool = False
+
+
+SCENARIOS: List[Scenario] = []
+
+
+def scenario(name: str, concurrent: bool = False):
+    def register(send: Send) -> Send:
+        SCENARIOS.append(Scenario(name, send, concurrent))
+        return send
+    return register
+
+
+def _post_body(state: State, i: int) -> dict:
+    return {
+        "platform": "linkedin",
+        "title": f"Benchmark post {state.run_id}-{i}",
+        "summary": "We are hiring engineers, apply before the deadline",
+        "tags": ["Job", "Benchmark"],
+        "original_url": f"https://linkedin.com/p/bench-{state.run_id}-{i}",
+    }
+
+
+# Scenarios run in this order, so creates fill the pools that updates and deletes drain
+
+@scenario("GET /users/me", concurrent=True)
+async def users_me(client, state, i):
+    return await client.get("/users/me")
+
+
+@scenario("PUT /users/me")
+async def update_me(client, state, i):
+    return await client.put("/users/me", json={"name": f"Benchmark User {i % 2}"})
+
+
+@scenario("POST /users/")
+async def create_user(client, state, i):
+    return await client.post("/users/", json={"email": f"bench-{state.run_id}-{state.next()}@example.com", "name": "Bench"})
+
+
+@scenario("GET /saved-posts/", concurrent=True)
+async def list_posts(client, state, i):
+    return await client.get("/saved-posts/", params={"limit": 20})
+
+
+@scenario("GET /saved-posts/?after=", concurrent=True)
+async def list_posts_page(client, state, i):
+    params = {"limit": 20}
+    if state.cursor:
+        params["after"] = state.cursor
+    return await client.get("/saved-posts/", params=params)
+
+
+@scenario("GET /saved-posts/?category=", concurrent=True)
+async def list_posts_by_tag(client, state, i):
+    return await client.get("/saved-posts/", params={"limit": 20, "category": "Job"})
+
+
+@scenario("GET /saved-posts/search", concurrent=True)
+async def search_posts(client, state, i):
+    return await client.get("/saved-posts/search", params={"q": "hiring engineer", "limit": 20})
+
+
+@scenario("POST /saved-posts/")
+async def create_post(client, state, i):
+    response = await client.post("/saved-posts/", json=_post_body(state, state.next()))
+    if response.status_code == 200:
+        state.created_posts.append(response.json()["id"])
+    return response
+
+
+@scenario("POST /saved-posts/bulk")
+async def bulk_posts(client, state, i):
+    body = "\n".join(json.dumps(_post_body(state, state.next())) for _ in range(20))
+    return await client.post("/saved-posts/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+
+@scenario("DELETE /saved-posts/{id}")
+async def delete_post(client, state, i):
+    return await client.delete(f"/saved-posts/{state.created_posts.pop()}")
+
+
+@scenario("GET /reminders/", concurrent=True)
+async def list_reminders(client, state, i):
+    return await client.get("/reminders/")
+
+
+@scenario("GET /reminders/upcoming", concurrent=True)
+async def upcoming_reminders(client, state, i):
+    return await client.get("/reminders/upcoming", params={"within": 30 * 24 * 3600})
+
+
+@scenario("POST /reminders/")
+async def create_reminder(client, state, i):
+    due_date = datetime.utcnow() + timedelta(days=7 + i)
+    response = await client.post("/reminders/", json={
+        "title": f"Benchmark reminder {i}", "description": "bench", "due_date": due_date.isoformat()
+    })
+    if response.status_code == 200:
+        state.created_reminders.append(response.json()["id"])
+    return response
+
+
+@scenario("PUT /reminders/{id}")
+async def update_reminder(client, state, i):
+    reminder_id = state.created_reminders[i % len(state.created_reminders)]
+    return await client.put(f"/reminders/{reminder_id}", json={"is_completed": i % 2 == 0})
+
+
+@scenario("PATCH /reminders/batch")
+async def batch_update_reminders(client, state, i):
+    return await client.patch(
+        "/reminders/batch", params={"ids": state.created_reminders[:20]}, json={"is_urgent": i % 2 == 0}
+    )
+
+
+@scenario("DELETE /reminders/{id}")
+async def delete_reminder(client, state, i):
+    return await client.delete(f"/reminders/{state.created_reminders.pop()}")
+
+
+@scenario("GET /chat/messages/", concurrent=True)
+async def chat_history(client, state, i):
+    return await client.get("/chat/messages/")
+
+
+@scenario("POST /chat/send/")
+async def chat_send(client, state, i):
+    return await client.post("/chat/send/", json={"message": "any jobs or scholarships due soon?"})
+
+
+@scenario("POST /chat/stream")
+async def chat_stream(client, state, i):
+    return await client.post("/chat/stream", json={"message": "show my hackathon posts"})
+
+
+@scenario("GET /analytics/", concurrent=True)
+async def analytics(client, state, i):
+    return await client.get("/analytics/")
+
+
+@scenario("GET /analytics/trends", concurrent=True)
+async def trends(client, state, i):
+    return await client.get("/analytics/trends", params={"granularity": "week" if i % 2 else "day"})
+
+
+@scenario("GET /export", concurrent=True)
+async def export(client, state, i):
+    return await client.get("/export", params={"format": "ndjson"})
+
+
+class QueryCounter:
+    """Counts statements sent to the database by the app's engines"""
+
+    def __init__(self):
+        self.count = 0
+
+    def attach(self, *engines) -> None:
+        for engine in engines:
+            target = getattr(engine, "sync_engine", engine)
+            event.listen(target, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args) -> None:
+        self.count += 1
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[rank]
+
+
+async def measure(client: httpx.AsyncClient, state: State, counter: QueryCounter, item: Scenario,
+                  requests: int, warmup: int, concurrency: int, throughput_requests: int) -> Dict[str, float]:
+    timings = []
+    queries = []
+    for i in range(warmup + requests):
+        counter.count = 0
+        started = time.perf_counter()
+        response = await item.send(client, state, i)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f"{item.name} answered {response.status_code}: {response.text[:200]}")
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            queries.append(counter.count)
+
+    result = {
+        "p50_ms": round(percentile(timings, 0.50), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "queries": max(queries),
+    }
+
+    if item.concurrent and throughput_requests:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i: int) -> None:
+            async with semaphore:
+                response = await item.send(client, state, i)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{item.name} answered {response.status_code} under load")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(throughput_requests)))
+        result["rps"] = round(throughput_requests / (time.perf_counter() - started), 1)
+    return result
+
+
+async def run_scenarios(token: str, requests: int, warmup: int, concurrency: int,
+                        throughput_requests: int, only: Optional[List[str]] = None) -> Dict[str, dict]:
+    import database
+    import main
+
+    counter = QueryCounter()
+    engines = {database.engine, database.async_engine, database.read_engine}
+    counter.attach(*engines)
+
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark",
+            headers={"Authorization": f"Bearer {token}"}, timeout=None
+        ) as client:
+            state = State(run_id=f"{time.time_ns():x}")
+            first_page = (await client.get("/saved-posts/", params={"limit": 20})).json()
+            state.cursor = first_page.get("next_cursor")
+
+            results = {}
+            for item in SCENARIOS:
+                if only and item.name not in only:
+                    continue
+                results[item.name] = await measure(
+                    client, state, counter, item, requests, warmup, concurrency, throughput_requests
+                )
+            return results
+    finally:
+        await main.app.router.shutdown()
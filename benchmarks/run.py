@@ -0,0 +1,231 @@
+"""Endpoint benchmarks with regression tracking
+
+Runs the app in-process (httpx ASGITransport, no network) against generated
+databases of several sizes, then compares with a committed baseline:
+
+    python benchmarks/run.py                         # small and medium, compare with baseline.json
+    python benchmarks/run.py --sizes large --requests 100
+    python benchmarks/run.py --update-baseline       # accept the current numbers
+
+Each size runs in its own worker process so `database` binds to that size's
+file. Query counts are compared exactly. Median latency and throughput are
+compared with --threshold and --rps-threshold, since they depend on the
+machine; tail percentiles are reported but too noisy to gate on. Refresh the
+baseline on the box the comparison runs on.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+
+# generate_data.py arguments per dataset size
+SIZES: Dict[str, Dict[str, float]] = {
+    "small": {"users": 5, "posts-per-user": 50, "reminders-per-user": 10, "messages-per-user": 20},
+    "medium": {"users": 20, "posts-per-user": 1000, "reminders-per-user": 50, "messages-per-user": 200},
+    "large": {"users": 50, "posts-per-user": 10000, "reminders-per-user": 200, "messages-per-user": 1000},
+}
+DATASET_SEED = 1234
+
+# Keep background work out of the measurements; echo replies are deterministic
+WORKER_ENV = {
+    "CLASSIFIER_AUTO_RECLASSIFY": "0",
+    "SCHEDULER_NOTIFIER": "none",
+    "CHAT_GENERATOR": "echo",
+    "AUTH_DEMO_FALLBACK": "0",
+}
+
+
+def dataset_path(data_dir: str, size: str) -> str:
+    params = json.dumps({"size": SIZES[size], "seed": DATASET_SEED}, sort_keys=True)
+    return os.path.join(data_dir, f"{size}-{hashlib.sha1(params.encode()).hexdigest()[:10]}.db")
+
+
+def build_dataset(path: str, size: str) -> None:
+    """Generate the pristine database for a size, with one API token per user"""
+    arguments = [sys.executable, os.path.join(ROOT, "generate_data.py"), "--seed", str(DATASET_SEED),
+                 "--tokens", path + ".tokens"]
+    for name, value in SIZES[size].items():
+        arguments.extend([f"--{name}", str(value)])
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    print(f"Generating {size} dataset at {path}", flush=True)
+    subprocess.run(arguments, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def heaviest_user_token(path: str) -> str:
+    """Token of the user with the most saved posts, so every endpoint sees real volume"""
+    tokens = dict(line.split() for line in open(path + ".tokens") if line.strip())
+    conn = sqlite3.connect(path)
+    try:
+        user_id = conn.execute(
+            "SELECT user_id FROM saved_posts GROUP BY user_id ORDER BY count(*) DESC, user_id LIMIT 1"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return tokens[str(user_id)]
+
+
+def run_size(args: argparse.Namespace, size: str) -> dict:
+    os.makedirs(args.data_dir, exist_ok=True)
+    pristine = dataset_path(args.data_dir, size)
+    if args.rebuild or not os.path.exists(pristine):
+        for stale in (pristine, pristine + ".tokens"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        build_dataset(pristine, size)
+
+    # Every run writes to a fresh copy so results do not drift with the data
+    work = os.path.join(args.data_dir, f"{size}-work.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(pristine, work)
+    output = os.path.join(args.data_dir, f"{size}-result.json")
+
+    env = dict(os.environ, **WORKER_ENV, DATABASE_URL=f"sqlite:///{work}", RESPONSE_CACHE_URL=args.cache)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    subprocess.run([
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--token", heaviest_user_token(pristine), "--worker-output", output,
+        "--requests", str(args.requests), "--warmup", str(args.warmup),
+        "--concurrency", str(args.concurrency), "--throughput-requests", str(args.throughput_requests),
+    ] + (["--only", *args.only] if args.only else []), cwd=ROOT, env=env, check=True)
+
+    with open(output) as result_file:
+        endpoints = json.load(result_file)
+    return {"dataset": SIZES[size], "endpoints": endpoints}
+
+
+def worker(args: argparse.Namespace) -> None:
+    sys.path.insert(0, ROOT)
+    from endpoints import run_scenarios
+
+    results = asyncio.run(run_scenarios(
+        args.token, args.requests, args.warmup, args.concurrency, args.throughput_requests, args.only
+    ))
+    with open(args.worker_output, "w") as result_file:
+        json.dump(results, result_file, indent=2)
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float, rps_threshold: float) -> List[str]:
+    """Describe every metric that regressed past the allowed margin"""
+    regressions = []
+    for size, current in results["sizes"].items():
+        expected_size = baseline.get("sizes", {}).get(size)
+        if expected_size is None:
+            print(f"{size}: no baseline, skipped")
+            continue
+        for name, metrics in current["endpoints"].items():
+            expected = expected_size["endpoints"].get(name)
+            if expected is None:
+                print(f"{size} {name}: new endpoint, no baseline")
+                continue
+            if metrics["queries"] > expected["queries"]:
+                regressions.append(f"{size} {name}: {metrics['queries']} queries per request (baseline {expected['queries']})")
+            now, before = metrics["p50_ms"], expected["p50_ms"]
+            if now > before * (1 + threshold) and now - before > min_delta_ms:
+                regressions.append(f"{size} {name}: p50 {now:.2f} ms (baseline {before:.2f} ms)")
+            if "rps" in metrics and "rps" in expected and metrics["rps"] < expected["rps"] * (1 - rps_threshold):
+                regressions.append(f"{size} {name}: {metrics['rps']:.0f} req/s (baseline {expected['rps']:.0f})")
+    return regressions
+
+
+def print_table(results: dict) -> None:
+    for size, current in results["sizes"].items():
+        print(f"\n{size}: {current['dataset']}")
+        print(f"  {'endpoint':<32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'req/s':>9}")
+        for name, metrics in current["endpoints"].items():
+            rps = f"{metrics['rps']:.0f}" if "rps" in metrics else "-"
+            print(
+                f"  {name:<32} {metrics['p50_ms']:>9.2f} {metrics['p95_ms']:>9.2f} "
+                f"{metrics['p99_ms']:>9.2f} {metrics['queries']:>8} {rps:>9}"
+            )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark every endpoint and compare with a baseline")
+    parser.add_argument("--sizes", default="small,medium", help=f"comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--requests", type=int, default=50, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight requests in the throughput phase")
+    parser.add_argument("--throughput-requests", type=int, default=200, help="0 skips the throughput phase")
+    parser.add_argument("--only", nargs="+", help="endpoint names to run, e.g. 'GET /analytics/'")
+    parser.add_argument("--cache", default="none", help="RESPONSE_CACHE_URL for the app under test")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--rps-threshold", type=float, default=0.5, help="allowed relative throughput drop")
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    parser.add_argument("--output", default=os.path.join(BENCHMARK_DIR, "results.json"))
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "stash-benchmarks"))
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the datasets")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--token", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.worker:
+        worker(args)
+        return 0
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        raise SystemExit(f"Unknown sizes: {', '.join(unknown)}")
+
+    results = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "cache": args.cache,
+        },
+        "sizes": {size: run_size(args, size) for size in sizes},
+    }
+    print_table(results)
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+        output_file.write("\n")
+    print(f"\nResults written to {args.output}")
+
+    if args.update_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with; run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare(
+            results, json.load(baseline_file), args.threshold, args.min_delta_ms, args.rps_threshold
+        )
+    if regressions:
+        print(f"\n{len(regressions)} regressions against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import secrets
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+import metrics
+import serialization
+
+# "memory" (default), "none", or a redis:// URL shared by every worker
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "memory")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+# Cached entry: (etag, serialized body)
+Entry = Tuple[str, bytes]
+
+
+class CacheBackend(ABC):
+    """Per-user version counters plus a body store; subclasses share these semantics"""
+
+    # Prefix of every ETag, so tags from another backend or boot never match
+    namespace = "r"
+
+    @abstractmethod
+    async def get_version(self, user_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def bump_version(self, user_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Entry]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, entry: Entry) -> None:
+        ...
+
+
+class NullBackend(CacheBackend):
+    namespace = "n"
+
+    async def get_version(self, user_id: int) -> int:
+        return 0
+
+    async def bump_version(self, user_id: int) -> int:
+        return 0
+
+    async def get(self, key: str) -> Optional[Entry]:
+        return None
+
+    async def set(self, key: str, entry: Entry) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """Process-local LRU with a TTL; fine for one worker, use redis when running several"""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._versions = {}
+        self._entries: "OrderedDict[str, Tuple[Entry, float]]" = OrderedDict()
+        # Versions restart at zero on boot, so tags carry a per-boot nonce
+        self.namespace = secrets.token_hex(4)
+
+    async def get_version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    async def bump_version(self, user_id: int) -> int:
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        return self._versions[user_id]
+
+    async def get(self, key: str) -> Optional[Entry]:
+        stored = self._entries.get(key)
+        if stored is None:
+            return None
+        entry, expires_at = stored
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: Entry) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (entry, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class RedisBackend(CacheBackend):
+    """Shared backend so every worker sees the same versions and bodies"""
+
+    def __init__(self, url: str, ttl: int = RESPONSE_CACHE_TTL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_URL points at redis but the redis package is not installed")
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+
+    async def get_version(self, user_id: int) -> int:
+        version = await self.client.get(f"stash:version:{user_id}")
+        return int(version or 0)
+
+    async def bump_version(self, user_id: int) -> int:
+        return await self.client.incr(f"stash:version:{user_id}")
+
+    async def get(self, key: str) -> Optional[Entry]:
+        value = await self.client.get(f"stash:response:{key}")
+        if value is None:
+            return None
+        etag, _, body = value.partition(b"\n")
+        return etag.decode(), body
+
+    async def set(self, key: str, entry: Entry) -> None:
+        etag, body = entry
+        await self.client.set(f"stash:response:{key}", etag.encode() + b"\n" + body, ex=self.ttl)
+
+
+def create_backend(url: str = RESPONSE_CACHE_URL) -> CacheBackend:
+    if url == "none":
+        return NullBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    return MemoryBackend()
+
+
+backend = create_backend()
+
+
+async def bump(user_id: int) -> None:
+    """Invalidate every cached read of the user; call after each committed write"""
+    await backend.bump_version(user_id)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as If-None-Match requires
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(
+        candidate.removeprefix("W/") == etag.removeprefix("W/") for candidate in candidates
+    )
+
+
+async def cached_json(
+    request: Request,
+    user_id: int,
+    endpoint: str,
+    build: Callable[[], Awaitable[object]],
+    max_age: Optional[int] = None,
+    raw: bool = False,
+) -> Response:
+    """Serve a per-user JSON read from the cache, answering 304 when the client is current
+
+    The ETag is derived from the user's version counter and the query, so a
+    matching If-None-Match is answered without running `build` or touching the
+    database. `max_age` rolls the tag over periodically for time-dependent payloads.
+    With `raw`, `build` returns plain dicts and lists that skip jsonable_encoder.
+    """
+    query = urlencode(sorted(request.query_params.multi_items()))
+    key = f"{user_id}:{endpoint}:{query}"
+    version = await backend.get_version(user_id)
+    bucket = f"-{int(time.time() // max_age)}" if max_age else ""
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    etag = f'W/"{backend.namespace}-{version}{bucket}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    entry = await backend.get(key)
+    if entry is not None and entry[0] == etag:
+        return Response(content=entry[1], media_type="application/json", headers=headers)
+
+    payload = await build()
+    with metrics.serializing():
+        body = serialization.dumps(payload if raw else jsonable_encoder(payload))
+    await backend.set(key, (etag, body))
+    return Response(content=body, media_type="application/json", headers=headers)
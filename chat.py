@@ -0,0 +1,114 @@
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+
+from models import ChatMessage
+
+# "canned" (default), "echo", or "package.module:ClassName" for a custom generator
+CHAT_GENERATOR = os.getenv("CHAT_GENERATOR", "canned")
+# Artificial pause between streamed tokens, in seconds
+CHAT_TOKEN_DELAY = float(os.getenv("CHAT_TOKEN_DELAY", "0"))
+
+TOKEN_PATTERN = re.compile(r"\S+\s*")
+
+
+class ReplyGenerator(ABC):
+    """Produces an assistant reply as a stream of text tokens"""
+
+    @abstractmethod
+    async def stream(self, message: str, context: Optional[dict] = None) -> AsyncIterator[str]:
+        ...
+
+    async def _emit(self, text: str) -> AsyncIterator[str]:
+        for token in TOKEN_PATTERN.findall(text):
+            if CHAT_TOKEN_DELAY:
+                await asyncio.sleep(CHAT_TOKEN_DELAY)
+            yield token
+
+
+def describe_context(context: Optional[dict]) -> str:
+    """Sentence naming the saved posts and reminders retrieved for a message, or ''"""
+    if not context:
+        return ""
+    parts = []
+    posts = context.get("posts") or []
+    if posts:
+        titles = ", ".join(f"'{post['title']}'" for post in posts)
+        parts.append(f"From your saved posts: {titles}.")
+    reminders = context.get("reminders") or []
+    if reminders:
+        titles = ", ".join(
+            f"'{reminder['title']}'" + (f" (due {reminder['due_date']:%Y-%m-%d})" if reminder["due_date"] else "")
+            for reminder in reminders
+        )
+        parts.append(f"Related reminders: {titles}.")
+    return " ".join(parts)
+
+
+class CannedReplyGenerator(ReplyGenerator):
+    async def stream(self, message: str, context: Optional[dict] = None) -> AsyncIterator[str]:
+        found = describe_context(context)
+        if found:
+            async for token in self._emit(f"Here is what I found about '{message}'. {found}"):
+                yield token
+            return
+
+        # Generate AI response (simplified)
+        ai_responses = [
+            f"I understand you're asking about '{message}'. Let me help you find relevant saved content.",
+            f"Based on your query about '{message}', I can help you organize your saved posts or set up reminders.",
+            "That's an interesting question! I can help you manage your saved content more effectively.",
+            "I'm here to help you with your saved posts and reminders. What specific assistance do you need?",
+            f"Regarding '{message}', I can help you categorize your content or create relevant reminders."
+        ]
+        async for token in self._emit(random.choice(ai_responses)):
+            yield token
+
+
+class EchoReplyGenerator(ReplyGenerator):
+    """Deterministic stand-in for tests and benchmarks"""
+
+    async def stream(self, message: str, context: Optional[dict] = None) -> AsyncIterator[str]:
+        found = describe_context(context)
+        async for token in self._emit(f"You said: {message}" + (f" {found}" if found else "")):
+            yield token
+
+
+GENERATORS = {
+    "canned": CannedReplyGenerator,
+    "echo": EchoReplyGenerator,
+}
+
+
+def load_generator(name: str = CHAT_GENERATOR) -> ReplyGenerator:
+    if name in GENERATORS:
+        return GENERATORS[name]()
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown CHAT_GENERATOR '{name}'")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+generator = load_generator()
+
+
+async def generate_reply(message: str, context: Optional[dict] = None) -> str:
+    """The whole reply, for callers that do not stream"""
+    return "".join([token async for token in generator.stream(message, context)])
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def build_exchange(user_id: int, text: str, received_at: datetime, reply: str) -> Tuple[ChatMessage, ChatMessage]:
+    """The user's message and the assistant's reply, ready to be added in one transaction"""
+    user_message = ChatMessage(user_id=user_id, message=text, is_user=True, timestamp=received_at)
+    ai_message = ChatMessage(user_id=user_id, message=reply, is_user=False, timestamp=datetime.utcnow())
+    return user_message, ai_message
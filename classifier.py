@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import stats as user_stats
+from models import SavedPost, AppState
+
+# Opportunity rules: whole-word keywords plus optional raw regex patterns
+RULES_PATH = os.getenv(
+    "CLASSIFIER_RULES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "classifier_rules.json")
+)
+RECLASSIFY_CHUNK_SIZE = int(os.getenv("RECLASSIFY_CHUNK_SIZE", "1000"))
+
+# app_state key holding the fingerprint of the rules ai_detected was last scored with
+STATE_KEY = "classifier.fingerprint"
+
+
+class Classifier:
+    def __init__(self, keywords: Iterable[str], patterns: Iterable[str] = ()):
+        self.keywords = sorted({keyword.strip().lower() for keyword in keywords if keyword.strip()})
+        self.patterns = list(patterns)
+
+        # One alternation for every rule, longest keywords first, so a post is
+        # scanned once instead of once per keyword
+        alternatives = [
+            re.escape(keyword)
+            for keyword in sorted(self.keywords, key=len, reverse=True)
+        ]
+        alternatives.extend(f"(?:{pattern})" for pattern in self.patterns)
+        self.regex = re.compile(r"\b(?:%s)\b" % "|".join(alternatives), re.IGNORECASE) if alternatives else None
+
+        rules = json.dumps({"keywords": self.keywords, "patterns": self.patterns}, sort_keys=True)
+        self.fingerprint = hashlib.sha256(rules.encode()).hexdigest()[:16]
+
+    @classmethod
+    def from_file(cls, path: str = RULES_PATH) -> "Classifier":
+        with open(path) as rules_file:
+            rules = json.load(rules_file)
+        return cls(rules.get("keywords", []), rules.get("patterns", []))
+
+    def matches(self, text: str) -> bool:
+        return bool(self.regex and text and self.regex.search(text))
+
+    def classify(self, title: str, summary: str) -> bool:
+        return self.matches(f"{title or ''}\n{summary or ''}")
+
+    def classify_batch(self, posts: Iterable[Tuple[str, str]]) -> List[bool]:
+        """Flag every (title, summary) pair with the compiled rule set"""
+        search = self.regex.search if self.regex else None
+        if search is None:
+            return [False for _ in posts]
+        return [bool(search(f"{title or ''}\n{summary or ''}")) for title, summary in posts]
+
+
+default_classifier = Classifier.from_file()
+
+
+def is_opportunity(title: str, summary: str) -> bool:
+    return default_classifier.classify(title, summary)
+
+
+def classify_batch(posts: Iterable[Tuple[str, str]]) -> List[bool]:
+    return default_classifier.classify_batch(posts)
+
+
+def stored_fingerprint(db: Session) -> Optional[str]:
+    state = db.get(AppState, STATE_KEY)
+    return state.value if state else None
+
+
+def needs_reclassify(db: Session, classifier: Classifier = None) -> bool:
+    classifier = classifier or default_classifier
+    return stored_fingerprint(db) != classifier.fingerprint
+
+
+def reclassify_posts(
+    session_factory: Callable[[], Session],
+    classifier: Classifier = None,
+    chunk_size: int = RECLASSIFY_CHUNK_SIZE,
+    pause: float = 0.0,
+    stop_event: Optional[threading.Event] = None,
+    on_change: Optional[Callable[[List[int]], None]] = None,
+) -> int:
+    """Re-score ai_detected for every post, one short transaction per chunk of ids
+
+    `on_change` is called after each commit with the ids of users whose posts changed.
+    """
+    classifier = classifier or default_classifier
+    changed = 0
+    last_id = 0
+    while True:
+        if stop_event is not None and stop_event.is_set():
+            # Interrupted; the fingerprint is left unchanged so the next run starts over
+            return changed
+        db = session_factory()
+        try:
+            rows = db.execute(
+                select(SavedPost.id, SavedPost.user_id, SavedPost.title, SavedPost.summary, SavedPost.ai_detected)
+                .where(SavedPost.id > last_id)
+                .order_by(SavedPost.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                # Remember the rules the table is now scored with
+                state = db.get(AppState, STATE_KEY)
+                if state is None:
+                    db.add(AppState(key=STATE_KEY, value=classifier.fingerprint))
+                else:
+                    state.value = classifier.fingerprint
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Another worker finished the same pass and recorded it first
+                    db.rollback()
+                return changed
+
+            flags = classifier.classify_batch((row.title, row.summary) for row in rows)
+            deltas: Counter = Counter()
+            for row, flag in zip(rows, flags):
+                if row.ai_detected is not None and flag == bool(row.ai_detected):
+                    continue
+                # Guard on the old value so concurrent runs never double count;
+                # legacy rows hold NULL, which only IS NULL can match
+                if row.ai_detected is None:
+                    unchanged = SavedPost.ai_detected.is_(None)
+                else:
+                    unchanged = SavedPost.ai_detected == row.ai_detected
+                result = db.execute(
+                    update(SavedPost)
+                    .where(SavedPost.id == row.id, unchanged)
+                    .values(ai_detected=flag)
+                )
+                if result.rowcount:
+                    # NULL counted as not detected; += 0 still marks the user as changed
+                    deltas[row.user_id] += (1 if flag else -1) if flag != bool(row.ai_detected) else 0
+                    changed += 1
+
+            for user_id, delta in deltas.items():
+                if delta:
+                    user_stats.record_ai_detected(db, user_id, delta)
+            db.commit()
+            if on_change is not None and deltas:
+                on_change(list(deltas))
+            last_id = rows[-1].id
+        finally:
+            db.close()
+
+        if pause:
+            # Give other writers a turn between chunks
+            time.sleep(pause)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Re-score SavedPost.ai_detected with the current rule set")
+    parser.add_argument("--force", action="store_true", help="re-score even if the rules have not changed")
+    parser.add_argument("--chunk-size", type=int, default=RECLASSIFY_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between chunks")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        outdated = needs_reclassify(db)
+    finally:
+        db.close()
+
+    if not outdated and not args.force:
+        print(f"ai_detected is already scored with rules {default_classifier.fingerprint}")
+    else:
+        changed = reclassify_posts(SessionLocal, chunk_size=args.chunk_size, pause=args.pause)
+        print(f"Re-scored posts with rules {default_classifier.fingerprint}; {changed} changed")
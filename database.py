@@ -1,25 +1,136 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from models import Base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from migrations import upgrade
 import os
 
 # Database URL - using SQLite for simplicity
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./stash_app.db")
 
-# Create engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+# Async driver used by the API for each sync backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
 
-# Create session
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+# The API runs on the async engine; the sync engine serves CLIs, migrations and seeding
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+connect_args = {"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+
+# Engine profile - every knob can be overridden from the environment
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),  # negative = KiB, so 64 MB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+POOL_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "-1")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "0") == "1",
+}
+
+# Serve GET endpoints from a separate read-only pool
+READ_POOL_ENABLED = os.getenv("DB_READ_POOL", "0") == "1"
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(POOL_OPTIONS["pool_size"] * 2)))
+
+def is_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")
+
+def sqlite_pragma_listener(read_only: bool = False):
+    pragmas = dict(SQLITE_PRAGMAS)
+    if read_only:
+        # The journal mode is a property of the file and is set by the writer
+        pragmas.pop("journal_mode")
+        pragmas["query_only"] = "ON"
+    
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+        finally:
+            cursor.close()
+    return apply_sqlite_pragmas
+
+def engine_options(url: str, async_driver: bool = False, pool_size: int = None) -> dict:
+    options = {"connect_args": connect_args}
+    if is_memory_sqlite(url):
+        return options
+    # aiosqlite would otherwise default to NullPool and reconnect per request
+    options["poolclass"] = AsyncAdaptedQueuePool if async_driver else QueuePool
+    options.update(POOL_OPTIONS)
+    if pool_size is not None:
+        options["pool_size"] = pool_size
+    return options
+
+def configure_engine(engine, read_only: bool = False):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", sqlite_pragma_listener(read_only))
+    return engine
+
+def to_read_only_url(url: str) -> str:
+    """Open a SQLite file read-only; other backends can point READ_DATABASE_URL at a replica"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or is_memory_sqlite(url):
+        return url
+    read_only = parsed.set(database=f"file:{parsed.database}", query={"mode": "ro", "uri": "true"})
+    return read_only.render_as_string(hide_password=False)
+
+# Create engines
+engine = configure_engine(create_engine(DATABASE_URL, **engine_options(DATABASE_URL)))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, async_driver=True))
+configure_engine(async_engine.sync_engine)
+
+if READ_POOL_ENABLED:
+    READ_DATABASE_URL = os.getenv("READ_DATABASE_URL") or to_read_only_url(ASYNC_DATABASE_URL)
+    read_engine = create_async_engine(
+        READ_DATABASE_URL,
+        **engine_options(READ_DATABASE_URL, async_driver=True, pool_size=READ_POOL_SIZE)
+    )
+    configure_engine(read_engine.sync_engine, read_only=True)
+else:
+    read_engine = async_engine
+
+# Create sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
 
 # Create tables
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    # Bring the schema to the latest version; see migrations.MIGRATIONS
+    upgrade(engine)
+
+# Close pooled connections on shutdown
+async def dispose_engines():
+    await async_engine.dispose()
+    if read_engine is not async_engine:
+        await read_engine.dispose()
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Dependency for read-only endpoints
+async def get_read_db():
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import rollups
+import stats as user_stats
+from models import PostTag, SavedPost
+from tags import load_tags, unique_tags
+
+# Posts hashed and merged per transaction by the dedupe job
+DEDUPE_CHUNK_SIZE = int(os.getenv("DEDUPE_CHUNK_SIZE", "1000"))
+
+# Query parameters that only record where a link was shared from
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "igshid", "igsh", "si", "feature", "ref", "ref_src",
+    "trk", "trackingid", "mc_cid", "mc_eid",
+}
+
+
+def normalize_url(url: Optional[str]) -> Optional[str]:
+    """Canonical form of a saved link, so copies of the same link compare equal
+
+    Lowercases the scheme and host, treats http as https, drops "www.",
+    default ports, fragments, trailing slashes and tracking parameters, and
+    sorts the remaining query parameters.
+    """
+    if not url or not url.strip():
+        return None
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+
+    scheme = parts.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith("utm_") and name.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, netloc, parts.path.rstrip("/"), urlencode(query), ""))
+
+
+def url_hash(url: Optional[str]) -> Optional[str]:
+    """Key of a link for the per-user unique index; None for posts without one"""
+    normalized = normalize_url(url)
+    if normalized is None:
+        return None
+    return hashlib.sha256(normalized.encode()).hexdigest()[:32]
+
+
+@dataclass
+class SaveResult:
+    id: int
+    # False when the post was merged into one saved earlier
+    created: bool
+    # The stored post after the save, as the retrieval index needs it
+    title: str
+    summary: str
+    tags: List[str]
+    platform: object
+
+
+def _merge(db: Session, existing, tags: Sequence[str], deadline: Optional[datetime], **values) -> List[str]:
+    """Add tags and a missing deadline to a stored post; returns the tags it gained"""
+    current = load_tags(existing.tags)
+    added = [tag for tag in unique_tags(tags) if tag not in current]
+    if added:
+        values["tags"] = json.dumps(current + added)
+    if existing.deadline is None and deadline is not None:
+        values.update(deadline=deadline, has_deadline=True)
+    if values:
+        db.execute(
+            update(SavedPost).where(SavedPost.id == existing.id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    if added:
+        db.execute(insert(PostTag), [
+            {"post_id": existing.id, "user_id": existing.user_id, "tag": tag} for tag in added
+        ])
+    return added
+
+
+def _insert_ignoring_duplicates(db: Session):
+    insert_for = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    return (
+        insert_for(SavedPost)
+        .on_conflict_do_nothing(index_elements=["user_id", "url_hash"])
+        .returning(SavedPost.id, SavedPost.url_hash)
+    )
+
+
+def save_posts(db: Session, user_id: int, posts: List[dict]) -> List[SaveResult]:
+    """Insert posts, merging any whose URL the user already saved into that post; the caller commits
+
+    `posts` are SavedPostCreate dicts with ai_detected set. Rows with a URL
+    go through INSERT ... ON CONFLICT DO NOTHING on (user_id, url_hash); the
+    ones that conflict add their tags (and a missing deadline) to the stored
+    post instead. Repeats of a URL within `posts` collapse the same way.
+    """
+    rows: List[dict] = []
+    slots: List[int] = []
+    by_hash: Dict[str, int] = {}
+    # Set here rather than by the column default, so the rollups see it too
+    saved_at = datetime.utcnow()
+    for post in posts:
+        tags = unique_tags(post["tags"])
+        digest = url_hash(post.get("original_url"))
+        if digest in by_hash:
+            row = rows[by_hash[digest]]
+            row["tags"] = unique_tags(row["tags"] + tags)
+            if row.get("deadline") is None and post.get("deadline") is not None:
+                row.update(deadline=post["deadline"], has_deadline=True)
+            slots.append(by_hash[digest])
+            continue
+        if digest is not None:
+            by_hash[digest] = len(rows)
+        slots.append(len(rows))
+        rows.append({**post, "tags": tags, "user_id": user_id, "url_hash": digest, "saved_at": saved_at})
+
+    def stored(row: dict) -> dict:
+        return {**row, "tags": json.dumps(row["tags"])}
+
+    ids: List[Optional[int]] = [None] * len(rows)
+    plain = [position for position, row in enumerate(rows) if row["url_hash"] is None]
+    if plain:
+        new_ids = db.execute(
+            insert(SavedPost).returning(SavedPost.id, sort_by_parameter_order=True),
+            [stored(rows[position]) for position in plain]
+        ).scalars().all()
+        for position, post_id in zip(plain, new_ids):
+            ids[position] = post_id
+    linked = [stored(row) for row in rows if row["url_hash"] is not None]
+    if linked:
+        for post_id, digest in db.execute(_insert_ignoring_duplicates(db), linked):
+            ids[by_hash[digest]] = post_id
+    created = [post_id is not None for post_id in ids]
+
+    tag_rows = [
+        {"post_id": ids[position], "user_id": user_id, "tag": tag}
+        for position, row in enumerate(rows) if created[position]
+        for tag in row["tags"]
+    ]
+    if tag_rows:
+        db.execute(insert(PostTag), tag_rows)
+    user_stats.record_posts(db, user_id, [
+        (row["platform"], row["tags"], row["ai_detected"])
+        for position, row in enumerate(rows) if created[position]
+    ])
+    rollups.add_posts(db, user_id, [
+        (ids[position], row["saved_at"], row["platform"], row["tags"])
+        for position, row in enumerate(rows) if created[position]
+    ])
+
+    # The rest conflicted with a post saved earlier
+    conflicts = {row["url_hash"]: position for position, row in enumerate(rows) if not created[position]}
+    if conflicts:
+        gained: Counter = Counter()
+        merged = []
+        for existing in db.execute(
+            select(
+                SavedPost.id, SavedPost.user_id, SavedPost.url_hash, SavedPost.title, SavedPost.summary,
+                SavedPost.tags, SavedPost.saved_at, SavedPost.platform, SavedPost.deadline
+            ).where(SavedPost.user_id == user_id, SavedPost.url_hash.in_(conflicts))
+        ):
+            position = conflicts[existing.url_hash]
+            row = rows[position]
+            added = _merge(db, existing, row["tags"], row.get("deadline"))
+            ids[position] = existing.id
+            row.update(
+                title=existing.title, summary=existing.summary,
+                tags=load_tags(existing.tags) + added, platform=existing.platform
+            )
+            gained.update(added)
+            merged.append((existing.id, existing.saved_at, existing.platform, added))
+        user_stats.record_tags(db, user_id, gained)
+        rollups.add_post_tags(db, user_id, merged)
+
+    results = []
+    seen = set()
+    for slot in slots:
+        row = rows[slot]
+        results.append(SaveResult(
+            ids[slot], created[slot] and slot not in seen,
+            row["title"], row["summary"], row["tags"], row["platform"]
+        ))
+        seen.add(slot)
+    return results
+
+
+# One-off job: hash posts saved before url_hash existed, merging duplicates
+
+def _collapse_chunk(db: Session, candidates: list) -> Tuple[int, int]:
+    """Hash one chunk of posts; any with a URL already taken merge into the oldest copy"""
+    groups: Dict[Tuple[int, str], list] = defaultdict(list)
+    for post in candidates:
+        digest = url_hash(post.original_url)
+        if digest is not None:
+            groups[(post.user_id, digest)].append(post)
+    if not groups:
+        return 0, 0
+
+    # Posts that already hold a hash win over the chunk's copies
+    keepers = {
+        (post.user_id, post.url_hash): post
+        for post in db.execute(
+            select(
+                SavedPost.id, SavedPost.user_id, SavedPost.url_hash, SavedPost.tags,
+                SavedPost.saved_at, SavedPost.platform, SavedPost.deadline
+            ).where(
+                SavedPost.user_id.in_({user_id for user_id, _ in groups}),
+                SavedPost.url_hash.in_({digest for _, digest in groups}),
+            )
+        )
+    }
+
+    hashed = []
+    losers: Dict[int, list] = defaultdict(list)
+    gained: Dict[int, Counter] = defaultdict(Counter)
+    merged: Dict[int, list] = defaultdict(list)
+    for (user_id, digest), posts in groups.items():
+        keeper = keepers.get((user_id, digest))
+        values = {}
+        if keeper is None:
+            keeper, posts = posts[0], posts[1:]
+            values["url_hash"] = digest
+        if not posts:
+            hashed.append({"post_id": keeper.id, "digest": digest})
+            continue
+        tags = [tag for post in posts for tag in load_tags(post.tags)]
+        deadline = next((post.deadline for post in posts if post.deadline is not None), None)
+        added = _merge(db, keeper, tags, deadline, **values)
+        gained[user_id].update(added)
+        merged[user_id].append((keeper.id, keeper.saved_at, keeper.platform, added))
+        losers[user_id].extend(posts)
+
+    if hashed:
+        db.execute(
+            update(SavedPost.__table__)
+            .where(SavedPost.__table__.c.id == bindparam("post_id"))
+            .values(url_hash=bindparam("digest")),
+            hashed
+        )
+
+    duplicate_ids = [post.id for posts in losers.values() for post in posts]
+    if duplicate_ids:
+        tag_rows = defaultdict(list)
+        for post_id, tag in db.execute(select(PostTag.post_id, PostTag.tag).where(PostTag.post_id.in_(duplicate_ids))):
+            tag_rows[post_id].append(tag)
+        db.execute(delete(PostTag).where(PostTag.post_id.in_(duplicate_ids)))
+        db.execute(
+            delete(SavedPost).where(SavedPost.id.in_(duplicate_ids))
+            .execution_options(synchronize_session=False)
+        )
+        for user_id, posts in losers.items():
+            user_stats.record_posts(db, user_id, [
+                (post.platform, tag_rows[post.id], post.ai_detected) for post in posts
+            ], sign=-1)
+            rollups.remove_posts(db, user_id, [
+                (post.id, post.saved_at, post.platform, tag_rows[post.id]) for post in posts
+            ])
+    for user_id, tag_deltas in gained.items():
+        user_stats.record_tags(db, user_id, tag_deltas)
+        rollups.add_post_tags(db, user_id, merged[user_id])
+    return len(groups), len(duplicate_ids)
+
+
+def collapse_duplicates(db: Session, chunk_size: int = DEDUPE_CHUNK_SIZE, progress=None) -> Dict[str, int]:
+    """Hash every post with a URL but no url_hash, merging duplicates, one committed chunk at a time
+
+    Duplicates of a link fold into its oldest post: their tags and a missing
+    deadline move over, and counters, rollups and post_tags follow.
+    """
+    totals = {"hashed": 0, "merged": 0}
+    last_id = 0
+    while True:
+        candidates = db.execute(
+            select(
+                SavedPost.id, SavedPost.user_id, SavedPost.original_url, SavedPost.tags,
+                SavedPost.saved_at, SavedPost.platform, SavedPost.deadline, SavedPost.ai_detected
+            )
+            .where(SavedPost.id > last_id, SavedPost.url_hash.is_(None), SavedPost.original_url.is_not(None))
+            .order_by(SavedPost.id)
+            .limit(chunk_size)
+        ).all()
+        if not candidates:
+            db.rollback()
+            return totals
+        links, duplicates = _collapse_chunk(db, candidates)
+        db.commit()
+        last_id = candidates[-1].id
+        totals["hashed"] += links
+        totals["merged"] += duplicates
+        if progress is not None:
+            progress(totals, last_id)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(
+        description="Hash saved post URLs and merge posts that save the same link twice"
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEDUPE_CHUNK_SIZE, help="posts per transaction")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        totals = collapse_duplicates(
+            db, args.chunk_size,
+            progress=lambda totals, last_id: print(
+                f"  through post {last_id}: {totals['hashed']} links, {totals['merged']} duplicates merged",
+                flush=True
+            )
+        )
+        print(f"Hashed {totals['hashed']} links and merged {totals['merged']} duplicate posts")
+    finally:
+        db.close()
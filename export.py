@@ -0,0 +1,97 @@
+import csv
+import enum
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, List
+
+from sqlalchemy import select
+
+from database import ReadSessionLocal
+from models import SavedPost, Reminder, ChatMessage
+from tags import load_tags
+
+# Rows fetched per round trip and serialized per response chunk
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Columns exported for each section, in output order
+EXPORT_SECTIONS = {
+    "posts": ("post", SavedPost, [
+        "id", "platform", "title", "summary", "tags", "saved_at",
+        "has_deadline", "deadline", "ai_detected", "original_url",
+    ]),
+    "reminders": ("reminder", Reminder, [
+        "id", "title", "description", "due_date", "is_completed", "is_urgent", "created_at",
+    ]),
+    "chat": ("chat_message", ChatMessage, [
+        "id", "message", "is_user", "timestamp",
+    ]),
+}
+
+# One CSV header covering every section; unused columns stay empty
+CSV_COLUMNS = ["record_type"] + list(dict.fromkeys(
+    column for _, _, columns in EXPORT_SECTIONS.values() for column in columns
+))
+
+
+def parse_include(include: str) -> List[str]:
+    sections = list(dict.fromkeys(part.strip() for part in include.split(",") if part.strip()))
+    unknown = [section for section in sections if section not in EXPORT_SECTIONS]
+    if unknown or not sections:
+        raise ValueError(f"include must be a comma-separated subset of {', '.join(EXPORT_SECTIONS)}")
+    return sections
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _record(record_type: str, row) -> Dict[str, object]:
+    record = {"record_type": record_type}
+    for column, value in row._mapping.items():
+        record[column] = load_tags(value) if column == "tags" else _plain(value)
+    return record
+
+
+def _csv_chunk(records: List[Dict[str, object]], header: bool = False) -> str:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    for record in records:
+        if "tags" in record:
+            record["tags"] = json.dumps(record["tags"])
+        writer.writerow(record)
+    return out.getvalue()
+
+
+async def stream_export(user_id: int, sections: List[str], fmt: str) -> AsyncIterator[str]:
+    """Stream the user's library one batch at a time with a server-side cursor"""
+    if fmt == "csv":
+        # Send the header straight away so the first byte does not wait on the database
+        yield _csv_chunk([], header=True)
+
+    # The request's session is closed before the body streams, so open our own
+    async with ReadSessionLocal() as db:
+        for section in sections:
+            record_type, model, columns = EXPORT_SECTIONS[section]
+            statement = (
+                select(*[getattr(model, column) for column in columns])
+                .where(model.user_id == user_id)
+                .order_by(model.id)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            result = await db.stream(statement)
+            async for partition in result.partitions():
+                records = [_record(record_type, row) for row in partition]
+                if fmt == "csv":
+                    yield _csv_chunk(records)
+                else:
+                    yield "".join(json.dumps(record) + "\n" for record in records)
@@ -0,0 +1,308 @@
+import argparse
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import insert, select, func
+from sqlalchemy.orm import Session
+
+import classifier
+import dedupe
+import rollups
+from auth import new_token, hash_token
+from database import SessionLocal, create_tables
+from models import User, ApiToken, SavedPost, PostTag, Reminder, ChatMessage, PlatformEnum
+from stats import rebuild_user_stats
+
+# Share of saved posts per platform
+PLATFORM_WEIGHTS = {
+    PlatformEnum.LINKEDIN: 0.40,
+    PlatformEnum.INSTAGRAM: 0.25,
+    PlatformEnum.YOUTUBE: 0.20,
+    PlatformEnum.TWITTER: 0.15,
+}
+
+BASE_TAGS = [
+    "Job", "Remote", "Internship", "Scholarship", "Hackathon", "Conference", "React",
+    "Python", "ML", "Design", "Career", "Education", "Startup", "Networking", "Study",
+    "Events", "Coding", "Data", "Cloud", "Security", "Product", "Research", "Writing",
+]
+
+# (kind, title templates, summary templates, chance the post has a deadline)
+POST_KINDS = [
+    ("job", [
+        "{role} at {company}",
+        "{company} is hiring a {role}",
+        "Remote {role} opening",
+    ], [
+        "Apply before the deadline; competitive salary and benefits.",
+        "New jobs posted this week, remote friendly.",
+        "Great opportunity to grow with a fast-moving team.",
+    ], 0.7),
+    ("scholarship", [
+        "{company} scholarship for {field} students",
+        "Fully funded {field} fellowship",
+    ], [
+        "Scholarships cover full tuition. Applying takes ten minutes.",
+        "Deadline is close, submit your essay soon.",
+    ], 0.8),
+    ("event", [
+        "{field} conference {year}",
+        "48-hour {field} hackathon",
+        "{company} meetup on {field}",
+    ], [
+        "Early bird registration ends soon.",
+        "Build something great with people from the community.",
+        "Talks, workshops and a lot of networking.",
+    ], 0.5),
+    ("learning", [
+        "Intro to {field} in 10 minutes",
+        "How {company} scaled their {field} stack",
+        "{field} study group notes",
+    ], [
+        "A short thread worth saving for later.",
+        "Clear walkthrough with code samples.",
+        "Weekly sessions and shared projects.",
+    ], 0.05),
+]
+KIND_WEIGHTS = [0.35, 0.1, 0.2, 0.35]
+
+ROLES = ["Backend Engineer", "React Developer", "Data Scientist", "Product Designer", "ML Engineer", "SRE"]
+COMPANIES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark Labs", "Wayne Tech"]
+FIELDS = ["AI", "Web", "Data", "Cloud", "Security", "Design", "Robotics"]
+
+REMINDER_TITLES = [
+    "Submit application", "Finish portfolio update", "Register for event",
+    "Send follow-up email", "Complete essay", "Prepare for interview",
+]
+CHAT_PROMPTS = [
+    "Show me my saved jobs", "Any scholarships due soon?", "What hackathons did I save?",
+    "Remind me about my deadlines", "Summarize my React posts", "What should I apply to first?",
+]
+
+
+def tag_vocabulary(size: int) -> List[str]:
+    return [BASE_TAGS[i] if i < len(BASE_TAGS) else f"Topic{i}" for i in range(size)]
+
+
+def zipf_weights(size: int, exponent: float = 1.1) -> List[float]:
+    # A few tags are everywhere, most are rare
+    return [1.0 / (rank ** exponent) for rank in range(1, size + 1)]
+
+
+def heavy_tailed(rng: random.Random, mean: float, sigma: float = 0.75) -> int:
+    """Lognormal count with the given mean; most users are light, a few are heavy"""
+    if mean <= 0:
+        return 0
+    return int(rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma))
+
+
+class Generator:
+    def __init__(self, args: argparse.Namespace, now: Optional[datetime] = None):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.now = now or datetime.utcnow()
+        self.tags = tag_vocabulary(args.tags)
+        self.tag_weights = zipf_weights(len(self.tags))
+        self.platforms = list(PLATFORM_WEIGHTS)
+        self.platform_weights = list(PLATFORM_WEIGHTS.values())
+
+    def user_rows(self, first_number: int, count: int) -> List[dict]:
+        return [
+            {
+                "email": f"user{number}@{self.args.email_domain}",
+                "name": f"Load Test User {number}",
+                "created_at": self.now - timedelta(days=self.rng.uniform(0, self.args.days)),
+                "is_active": True,
+            }
+            for number in range(first_number, first_number + count)
+        ]
+
+    def post_rows(self, user_id: int) -> List[dict]:
+        rng = self.rng
+        rows = []
+        for _ in range(heavy_tailed(rng, self.args.posts_per_user)):
+            kind, titles, summaries, deadline_chance = rng.choices(POST_KINDS, KIND_WEIGHTS)[0]
+            values = {
+                "role": rng.choice(ROLES), "company": rng.choice(COMPANIES),
+                "field": rng.choice(FIELDS), "year": self.now.year,
+            }
+            platform = rng.choices(self.platforms, self.platform_weights)[0]
+            tag_count = rng.randint(0, self.args.max_tags_per_post)
+            tags = list(dict.fromkeys(rng.choices(self.tags, self.tag_weights, k=tag_count)))
+            # Recent saves are more common than old ones
+            saved_at = self.now - timedelta(days=self.args.days * rng.random() ** 2)
+            has_deadline = rng.random() < deadline_chance
+            url = f"https://{platform.value}.com/p/{rng.getrandbits(48):012x}"
+            rows.append({
+                "user_id": user_id,
+                "platform": platform,
+                "title": rng.choice(titles).format(**values),
+                "summary": rng.choice(summaries),
+                "tags": json.dumps(tags),
+                "saved_at": saved_at,
+                "has_deadline": has_deadline,
+                "deadline": saved_at + timedelta(days=rng.uniform(1, 60)) if has_deadline else None,
+                "original_url": url,
+                "url_hash": dedupe.url_hash(url),
+            })
+        # Same rules the API applies, so the data never drifts from the classifier
+        flags = classifier.classify_batch((row["title"], row["summary"]) for row in rows)
+        for row, flag in zip(rows, flags):
+            row["ai_detected"] = flag
+        return rows
+
+    def reminder_rows(self, user_id: int) -> List[dict]:
+        rng = self.rng
+        rows = []
+        for _ in range(heavy_tailed(rng, self.args.reminders_per_user)):
+            is_completed = rng.random() < self.args.completed_ratio
+            if is_completed or rng.random() < self.args.overdue_ratio:
+                due_date = self.now - timedelta(days=rng.uniform(0, self.args.days))
+            else:
+                due_date = self.now + timedelta(days=rng.uniform(0, 90))
+            overdue = not is_completed and due_date <= self.now
+            rows.append({
+                "user_id": user_id,
+                "title": rng.choice(REMINDER_TITLES),
+                "description": rng.choice(FIELDS) + " " + rng.choice(["deadline", "follow-up", "prep"]),
+                "due_date": due_date,
+                "is_completed": is_completed,
+                "is_urgent": rng.random() < 0.2,
+                "created_at": due_date - timedelta(days=rng.uniform(1, 30)),
+                # Overdue reminders were already delivered; keep the scheduler from replaying them
+                "notified_at": due_date if overdue else None,
+            })
+        return rows
+
+    def message_rows(self, user_id: int) -> List[dict]:
+        rng = self.rng
+        rows = []
+        timestamp = self.now - timedelta(days=rng.uniform(0, self.args.days))
+        for _ in range(heavy_tailed(rng, self.args.messages_per_user / 2)):
+            prompt = rng.choice(CHAT_PROMPTS)
+            timestamp += timedelta(seconds=rng.uniform(30, 3600))
+            rows.append({"user_id": user_id, "message": prompt, "is_user": True, "timestamp": timestamp})
+            timestamp += timedelta(seconds=rng.uniform(1, 5))
+            rows.append({
+                "user_id": user_id,
+                "message": f"Here is what I found about '{prompt}'.",
+                "is_user": False,
+                "timestamp": timestamp,
+            })
+        return rows
+
+
+def insert_chunked(db: Session, model, rows: List[dict], chunk_size: int, returning: bool = False) -> List[int]:
+    """executemany INSERTs of at most chunk_size rows; returns ids in row order when asked
+
+    Goes through the Core connection rather than the ORM bulk path, which
+    splices RETURNING batches back together in quadratic time.
+    """
+    conn = db.connection()
+    table = model.__table__
+    ids = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        if returning:
+            ids.extend(conn.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True), chunk
+            ).scalars())
+        else:
+            conn.execute(insert(table), chunk)
+    return ids
+
+
+def generate(args: argparse.Namespace) -> dict:
+    generator = Generator(args)
+    totals = {"users": 0, "posts": 0, "post_tags": 0, "reminders": 0, "messages": 0}
+    tokens = []
+
+    db = SessionLocal()
+    try:
+        first_number = (db.execute(select(func.max(User.id))).scalar() or 0) + 1
+        for batch_start in range(0, args.users, args.users_per_batch):
+            count = min(args.users_per_batch, args.users - batch_start)
+            user_ids = insert_chunked(
+                db, User, generator.user_rows(first_number + batch_start, count), args.chunk_size, returning=True
+            )
+
+            posts, post_tags, reminders, messages = [], [], [], []
+            for user_id in user_ids:
+                posts.extend(generator.post_rows(user_id))
+                reminders.extend(generator.reminder_rows(user_id))
+                messages.extend(generator.message_rows(user_id))
+
+            post_ids = insert_chunked(db, SavedPost, posts, args.chunk_size, returning=True)
+            for post_id, row in zip(post_ids, posts):
+                post_tags.extend(
+                    {"post_id": post_id, "user_id": row["user_id"], "tag": tag} for tag in json.loads(row["tags"])
+                )
+            insert_chunked(db, PostTag, post_tags, args.chunk_size)
+            insert_chunked(db, Reminder, reminders, args.chunk_size)
+            insert_chunked(db, ChatMessage, messages, args.chunk_size)
+
+            if args.tokens:
+                batch_tokens = [(user_id, new_token()) for user_id in user_ids]
+                insert_chunked(db, ApiToken, [
+                    {"token_hash": hash_token(token), "user_id": user_id} for user_id, token in batch_tokens
+                ], args.chunk_size)
+                tokens.extend(batch_tokens)
+
+            for user_id in user_ids:
+                rebuild_user_stats(db, user_id)
+            db.commit()
+
+            totals["users"] += len(user_ids)
+            totals["posts"] += len(posts)
+            totals["post_tags"] += len(post_tags)
+            totals["reminders"] += len(reminders)
+            totals["messages"] += len(messages)
+            print(f"  {totals['users']}/{args.users} users, {totals['posts']} posts", flush=True)
+
+        # Count the new rows in the trend rollups now rather than on the next write
+        rollups.catch_up(db)
+    finally:
+        db.close()
+
+    if args.tokens:
+        with open(args.tokens, "w") as token_file:
+            for user_id, token in tokens:
+                token_file.write(f"{user_id} {token}\n")
+    return totals
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fill the database with synthetic users, posts, reminders and chat")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts-per-user", type=float, default=200, help="mean; counts are heavy-tailed")
+    parser.add_argument("--tags", type=int, default=50, help="size of the tag vocabulary")
+    parser.add_argument("--max-tags-per-post", type=int, default=4)
+    parser.add_argument("--reminders-per-user", type=float, default=20, help="mean")
+    parser.add_argument("--completed-ratio", type=float, default=0.4, help="share of reminders already completed")
+    parser.add_argument("--overdue-ratio", type=float, default=0.1, help="share of open reminders past due")
+    parser.add_argument("--messages-per-user", type=float, default=40, help="mean, user and assistant combined")
+    parser.add_argument("--days", type=float, default=365, help="history spread of saved_at and chat")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per INSERT")
+    parser.add_argument("--users-per-batch", type=int, default=50, help="users per transaction")
+    parser.add_argument("--email-domain", default="loadtest.example")
+    parser.add_argument("--tokens", metavar="FILE", help="issue an API token per user and write 'user_id token' lines")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    create_tables()
+    started = time.perf_counter()
+    totals = generate(args)
+    elapsed = time.perf_counter() - started
+    rows = sum(totals.values())
+    print(
+        f"Generated {totals['users']} users, {totals['posts']} posts ({totals['post_tags']} tags), "
+        f"{totals['reminders']} reminders and {totals['messages']} chat messages "
+        f"in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
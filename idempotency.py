@@ -0,0 +1,184 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+import auth
+from database import AsyncSessionLocal
+from models import IdempotencyKey
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "1") == "1"
+# How long a key replays its first response before it can be reused
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# Larger responses are not kept; a retry of such a request runs it again
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(4 * 1024 * 1024)))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+# Seconds between sweeps of expired keys, per process
+PURGE_INTERVAL = 60
+
+HEADER = b"idempotency-key"
+# Statuses a client is expected to retry, so they release the key instead of being replayed
+RETRYABLE_STATUSES = {401, 408, 429}
+
+
+def _insert_for(db):
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+
+async def _plain_response(send, status: int, detail: str, headers=()) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """Pure ASGI middleware replaying the stored response of a POST retried with the same Idempotency-Key
+
+    Keys belong to the API token that sent them (or the demo user without
+    one). The first request claims the key; while it runs, a retry gets 409.
+    Once it finishes, retries get its status, headers and body back with
+    Idempotent-Replayed: true. Server errors release the key.
+    """
+
+    def __init__(self, app, ttl: int = IDEMPOTENCY_TTL):
+        self.app = app
+        self.ttl = ttl
+        self._last_purge = 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        key = None
+        token_hash = auth.DEMO_KEY
+        for name, value in scope["headers"]:
+            if name == HEADER:
+                key = value.decode("latin-1").strip()
+            elif name == b"authorization":
+                scheme, _, credentials = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and credentials.strip():
+                    token_hash = auth.hash_token(credentials.strip())
+        if key is None or (token_hash == auth.DEMO_KEY and not auth.AUTH_DEMO_FALLBACK):
+            # Anonymous requests are rejected downstream unless the demo fallback is on
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            await _plain_response(
+                send, 400, f"Idempotency-Key must be 1 to {IDEMPOTENCY_MAX_KEY_LENGTH} characters"
+            )
+            return
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        fingerprint = f"{scope['method']} {scope['path']}" + (f"?{query}" if query else "")
+        stored = await self._claim(token_hash, key, fingerprint)
+        if stored is not None:
+            await self._replay(send, stored, fingerprint)
+            return
+
+        start = None
+        chunks = []
+        size = 0
+
+        async def send_recorded(message):
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body" and size <= IDEMPOTENCY_MAX_BODY:
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_recorded)
+        except BaseException:
+            await self._release(token_hash, key)
+            raise
+
+        status = start["status"] if start else 500
+        if status >= 500 or status in RETRYABLE_STATUSES or size > IDEMPOTENCY_MAX_BODY:
+            await self._release(token_hash, key)
+            return
+        headers = [[name.decode("latin-1"), value.decode("latin-1")] for name, value in start["headers"]]
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.token_hash == token_hash, IdempotencyKey.key == key)
+                .values(status_code=status, headers=json.dumps(headers), body=b"".join(chunks))
+            )
+            await db.commit()
+
+    async def _claim(self, token_hash: str, key: str, fingerprint: str) -> Optional[IdempotencyKey]:
+        """Claim the key for this request; returns the existing row when another request holds it"""
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=self.ttl)
+        async with AsyncSessionLocal() as db:
+            if time.monotonic() - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = time.monotonic()
+                await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < expired))
+
+            claimed = (await db.execute(
+                _insert_for(db)(IdempotencyKey)
+                .values(token_hash=token_hash, key=key, fingerprint=fingerprint, created_at=now)
+                .on_conflict_do_nothing(index_elements=["token_hash", "key"])
+            )).rowcount
+            if not claimed:
+                # An expired key is free to take over
+                claimed = (await db.execute(
+                    update(IdempotencyKey)
+                    .where(
+                        IdempotencyKey.token_hash == token_hash, IdempotencyKey.key == key,
+                        IdempotencyKey.created_at < expired,
+                    )
+                    .values(fingerprint=fingerprint, status_code=None, headers=None, body=None, created_at=now)
+                )).rowcount
+            existing = None
+            if not claimed:
+                existing = (await db.execute(
+                    select(IdempotencyKey)
+                    .where(IdempotencyKey.token_hash == token_hash, IdempotencyKey.key == key)
+                )).scalar()
+            await db.commit()
+        if claimed:
+            return None
+        # Released between the insert and the select; the retry may run
+        if existing is None:
+            return await self._claim(token_hash, key, fingerprint)
+        return existing
+
+    async def _release(self, token_hash: str, key: str) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(IdempotencyKey)
+                .where(IdempotencyKey.token_hash == token_hash, IdempotencyKey.key == key)
+            )
+            await db.commit()
+
+    async def _replay(self, send, stored: IdempotencyKey, fingerprint: str) -> None:
+        if stored.fingerprint != fingerprint:
+            await _plain_response(
+                send, 422, f"Idempotency-Key was already used for {stored.fingerprint}"
+            )
+            return
+        if stored.status_code is None:
+            await _plain_response(
+                send, 409, "A request with this Idempotency-Key is still being processed",
+                headers=[(b"retry-after", b"1")]
+            )
+            return
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(stored.headers)]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": stored.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": stored.body or b""})
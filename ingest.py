@@ -0,0 +1,158 @@
+import codecs
+import json
+import logging
+import os
+from typing import AsyncIterator, List, Tuple, Union
+
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import classifier
+import dedupe
+import retrieval
+from schemas import SavedPostCreate
+
+# Rows validated and inserted per transaction
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+
+_decoder = json.JSONDecoder()
+
+logger = logging.getLogger("stash.ingest")
+
+
+class MalformedRow(Exception):
+    pass
+
+
+async def iter_json_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Union[object, MalformedRow]]:
+    """Yield objects from a streamed JSON array or NDJSON body as they arrive"""
+    decode = codecs.getincrementaldecoder("utf-8")(errors="replace").decode
+    buffer = ""
+    mode = None  # "array" or "ndjson", sniffed from the first non-blank character
+
+    async for chunk in chunks:
+        buffer += decode(chunk)
+        if mode is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            mode = "array" if stripped[0] == "[" else "ndjson"
+            buffer = stripped[1:] if mode == "array" else stripped
+
+        if mode == "ndjson":
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        else:
+            buffer, rows, done = _drain_array(buffer, final=False)
+            for row in rows:
+                yield row
+            if done:
+                return
+
+    buffer += decode(b"", final=True)
+    if mode == "ndjson":
+        if buffer.strip():
+            yield _parse_line(buffer)
+    elif mode == "array":
+        _, rows, done = _drain_array(buffer, final=True)
+        for row in rows:
+            yield row
+        if not done:
+            yield MalformedRow("JSON array is not terminated")
+
+
+def _parse_line(line: str) -> Union[object, MalformedRow]:
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        return MalformedRow(f"Invalid JSON: {exc}")
+
+
+def _drain_array(buffer: str, final: bool) -> Tuple[str, List[Union[object, MalformedRow]], bool]:
+    """Decode every complete element at the head of a JSON array buffer"""
+    rows = []
+    position = 0
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            return "", rows, False
+        if buffer[position] == "]":
+            return "", rows, True
+        try:
+            row, position = _decoder.raw_decode(buffer, position)
+        except ValueError as exc:
+            # An element cut off at the chunk boundary; wait for more input
+            if not final:
+                return buffer[position:], rows, False
+            rows.append(MalformedRow(f"Invalid JSON: {exc}"))
+            return "", rows, True
+        rows.append(row)
+
+
+def _validate(row: Union[object, MalformedRow]) -> Union[SavedPostCreate, str]:
+    if isinstance(row, MalformedRow):
+        return str(row)
+    if not isinstance(row, dict):
+        return "Each row must be a JSON object"
+    try:
+        return SavedPostCreate.model_validate(row)
+    except ValidationError as exc:
+        return "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+        )
+
+
+async def _insert_chunk(db: AsyncSession, user_id: int, chunk: List[Tuple[int, SavedPostCreate]]) -> List[dict]:
+    """Save one chunk of validated posts in a single transaction, merging already-saved URLs"""
+    flags = classifier.classify_batch((post.title, post.summary) for _, post in chunk)
+
+    rows = []
+    for (_, post), ai_detected in zip(chunk, flags):
+        post_data = post.dict()
+        post_data["ai_detected"] = ai_detected
+        rows.append(post_data)
+
+    try:
+        saved = await db.run_sync(dedupe.save_posts, user_id, rows)
+        await db.commit()
+    except SQLAlchemyError:
+        await db.rollback()
+        # Driver messages stay in the log; clients only learn the chunk was not saved
+        logger.exception("Bulk insert of %d posts for user %s failed", len(chunk), user_id)
+        return [{"index": index, "status": "error", "error": "Insert failed"} for index, _ in chunk]
+
+    retrieval.index.add_posts(user_id, [
+        (result.id, result.title, result.summary, result.tags, result.platform) for result in saved
+    ])
+    return [
+        {"index": index, "status": "created" if result.created else "merged", "id": result.id}
+        for (index, _), result in zip(chunk, saved)
+    ]
+
+
+async def ingest_posts(db: AsyncSession, user_id: int, chunks: AsyncIterator[bytes]) -> List[dict]:
+    """Validate streamed rows incrementally and insert them chunk by chunk"""
+    results = []
+    pending: List[Tuple[int, SavedPostCreate]] = []
+    index = -1
+
+    async for row in iter_json_rows(chunks):
+        index += 1
+        post = _validate(row)
+        if isinstance(post, str):
+            results.append({"index": index, "status": "error", "error": post})
+            continue
+        pending.append((index, post))
+        if len(pending) >= BULK_CHUNK_SIZE:
+            results.extend(await _insert_chunk(db, user_id, pending))
+            pending = []
+
+    if pending:
+        results.extend(await _insert_chunk(db, user_id, pending))
+
+    results.sort(key=lambda result: result["index"])
+    return results
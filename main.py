@@ -1,22 +1,53 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
-import json
-from datetime import datetime, timedelta
-import random
-
-from database import get_db, create_tables
-from models import User, SavedPost, Reminder, ChatMessage, PlatformEnum
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import case, delete, func, select, update, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+import asyncio
+import os
+import threading
+
+import database
+from database import SessionLocal, AsyncSessionLocal, get_db, get_read_db, create_tables, dispose_engines
+from models import User, SavedPost, PostTag, Reminder, ChatMessage
+from pagination import encode_cursor, decode_datetime_cursor
+import stats as user_stats
+import analytics
+import search
+import classifier
+import ingest
+import export
+import auth
+import cache as response_cache
+import chat
+import retrieval
+import scheduler
+import rollups
+import metrics
+import serialization
+import compression
+import dedupe
+import idempotency
+from auth import Identity
 from schemas import (
-    UserCreate, User as UserSchema,
-    SavedPostCreate, SavedPost as SavedPostSchema, SavedPostsResponse,
-    ReminderCreate, ReminderUpdate, Reminder as ReminderSchema,
+    UserCreate, UserUpdate, User as UserSchema, UserWithToken,
+    SavedPostCreate, SavedPost as SavedPostSchema, SavedPostsResponse, SearchResponse,
+    BulkIngestResponse,
+    ReminderCreate, ReminderUpdate, Reminder as ReminderSchema, ReminderBatchResponse,
     ChatMessageCreate, ChatMessage as ChatMessageSchema, ChatResponse
 )
 
 # Create FastAPI app
-app = FastAPI(title="Stash API", description="Backend for Stash content management app")
+app = FastAPI(
+    title="Stash API",
+    description="Backend for Stash content management app",
+    default_response_class=serialization.FastJSONResponse
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -27,269 +58,750 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create tables on startup
+# Retried POSTs with an Idempotency-Key header get the first response back
+if idempotency.IDEMPOTENCY_ENABLED:
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+
+# gzip (or brotli, when installed) for bodies above COMPRESSION_MIN_SIZE
+if compression.COMPRESSION_ENABLED:
+    app.add_middleware(compression.CompressionMiddleware)
+
+# Per-route latency, SQL and pool timings, served at /metrics
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(database.engine, "sync")
+    metrics.instrument_engine(database.async_engine, "primary")
+    if database.read_engine is not database.async_engine:
+        metrics.instrument_engine(database.read_engine, "read")
+
+# Fields list endpoints can project with ?fields=, in response order
+POST_FIELDS = list(SavedPostSchema.model_fields)
+REMINDER_FIELDS = list(ReminderSchema.model_fields)
+MESSAGE_FIELDS = list(ChatMessageSchema.model_fields)
+
+
+def projection(fields: Optional[str], allowed: List[str]) -> List[str]:
+    try:
+        return serialization.parse_fields(fields, allowed)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+# Create tables on startup; serve.py migrates once before forking and turns this off
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "1") == "1"
+ready = threading.Event()
+
 @app.on_event("startup")
 def startup_event():
-    create_tables()
-
-# Helper function to get current user (simplified for demo)
-def get_current_user(db: Session = Depends(get_db)) -> User:
-    # In a real app, you'd validate JWT token here
-    user = db.query(User).first()
-    if not user:
-        # Create a demo user if none exists
-        user = User(email="demo@example.com", name="Demo User")
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return user
+    if RUN_MIGRATIONS_ON_STARTUP:
+        create_tables()
+        # Rows written outside the API (imports, seeding) reach the rollups here
+        db = SessionLocal()
+        try:
+            rollups.catch_up(db)
+        finally:
+            db.close()
+
+# Re-score ai_detected in the background when the classifier rules change;
+# serve.py runs the pass once before starting workers and turns this off
+CLASSIFIER_AUTO_RECLASSIFY = os.getenv("CLASSIFIER_AUTO_RECLASSIFY", "1") == "1"
+background_tasks = set()
+stop_background_jobs = threading.Event()
+
+@app.on_event("startup")
+async def start_background_jobs():
+    if scheduler.SCHEDULER_ENABLED:
+        # Pending reminders are loaded once; endpoints keep the scheduler current
+        await scheduler.scheduler.start(scheduler.load_pending_reminders)
+    
+    if CLASSIFIER_AUTO_RECLASSIFY:
+        db = SessionLocal()
+        try:
+            outdated = classifier.needs_reclassify(db)
+        finally:
+            db.close()
+        if outdated:
+            loop = asyncio.get_running_loop()
+            
+            def invalidate(user_ids):
+                for user_id in user_ids:
+                    asyncio.run_coroutine_threadsafe(response_cache.bump(user_id), loop)
+            
+            task = asyncio.create_task(asyncio.to_thread(
+                classifier.reclassify_posts, SessionLocal, pause=0.05,
+                stop_event=stop_background_jobs, on_change=invalidate
+            ))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+    
+    ready.set()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Fail readiness first so load balancers stop routing here
+    ready.clear()
+    stop_background_jobs.set()
+    await scheduler.scheduler.stop()
+    await dispose_engines()
+
+# Bearer token authentication; identities are served from an in-process cache
+bearer_scheme = HTTPBearer(auto_error=False)
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> Identity:
+    if credentials is None:
+        if not auth.AUTH_DEMO_FALLBACK:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        key = auth.DEMO_KEY
+    else:
+        key = auth.hash_token(credentials.credentials)
+    
+    identity = auth.identity_cache.get(key)
+    if identity is None:
+        if credentials is None:
+            identity = await db.run_sync(auth.lookup_demo_user)
+        else:
+            identity = await db.run_sync(auth.lookup_token, key)
+        if identity is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        auth.identity_cache.put(key, identity)
+    
+    if not identity.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    return identity
 
 # User endpoints
-@app.post("/users/", response_model=UserSchema)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
+@app.post("/users/", response_model=UserWithToken)
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     db_user = User(**user.dict())
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    await db.flush()
+    await db.run_sync(user_stats.init_user_stats, db_user.id)
+    token = await db.run_sync(auth.issue_token, db_user.id)
+    await db.commit()
+    await db.refresh(db_user)
+    auth.identity_cache.invalidate_user(db_user.id)
+    return UserWithToken(**Identity.from_user(db_user).__dict__, api_token=token)
 
 @app.get("/users/me", response_model=UserSchema)
-def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: Identity = Depends(get_current_user)):
     return current_user
 
+@app.put("/users/me", response_model=UserSchema)
+async def update_current_user(
+    user_update: UserUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    values = user_update.dict(exclude_unset=True)
+    if values:
+        try:
+            await db.execute(update(User).where(User.id == current_user.id).values(**values))
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Email already registered")
+    
+    # Cached identities of this user are stale now
+    auth.identity_cache.invalidate_user(current_user.id)
+    user = (await db.execute(select(User).where(User.id == current_user.id))).scalar()
+    return Identity.from_user(user)
+
 # SavedPost endpoints
 @app.get("/saved-posts/", response_model=SavedPostsResponse)
-def get_saved_posts(
+async def get_saved_posts(
+    request: Request,
     skip: int = 0, 
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=500),
     category: str = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    after: Optional[str] = None,
+    include_total: bool = True,
+    fields: Optional[str] = Query(None, description="Comma-separated post fields to return"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    query = db.query(SavedPost).filter(SavedPost.user_id == current_user.id)
-    
-    if category and category != "All":
-        query = query.filter(SavedPost.tags.contains(category))
-    
-    posts = query.offset(skip).limit(limit).all()
-    total = query.count()
+    names = projection(fields, POST_FIELDS)
     
-    # Convert tags from JSON string to list
-    for post in posts:
-        if post.tags:
-            post.tags = json.loads(post.tags) if isinstance(post.tags, str) else post.tags
-    
-    # Calculate stats
-    stats = {
-        "total_items": total,
-        "active_reminders": db.query(Reminder).filter(
-            Reminder.user_id == current_user.id,
-            Reminder.is_completed == False
-        ).count(),
-        "completed_items": db.query(Reminder).filter(
-            Reminder.user_id == current_user.id,
-            Reminder.is_completed == True
-        ).count()
-    }
+    async def build():
+        # Plain rows of only the requested columns; the cursor always needs saved_at and id
+        query = select(*serialization.columns(SavedPost, names, always=("saved_at", "id")))
+        query = query.where(SavedPost.user_id == current_user.id)
+        
+        if category and category != "All":
+            query = query.join(PostTag).where(
+                PostTag.user_id == current_user.id,
+                PostTag.tag == category
+            )
+        
+        counters = await db.run_sync(user_stats.get_user_stats, current_user.id)
+        total = None
+        if include_total:
+            if category and category != "All":
+                total = await db.run_sync(user_stats.get_tag_count, current_user.id, category)
+            else:
+                total = counters["total_posts"]
+        
+        # Newest first; ?after= seeks past the last row of the previous page
+        # on the (user_id, saved_at, id) index instead of skipping rows
+        page = query.order_by(SavedPost.saved_at.desc(), SavedPost.id.desc())
+        if after:
+            saved_at, post_id = decode_datetime_cursor(after)
+            page = page.where(tuple_(SavedPost.saved_at, SavedPost.id) < tuple_(saved_at, post_id))
+        else:
+            page = page.offset(skip)
+        rows = (await db.execute(page.limit(limit))).all()
+        
+        next_cursor = None
+        if rows and len(rows) == limit:
+            next_cursor = encode_cursor([rows[-1].saved_at, rows[-1].id])
+        
+        # Calculate stats
+        stats = {
+            "total_items": total,
+            "active_reminders": counters["active_reminders"],
+            "completed_items": counters["completed_reminders"]
+        }
+        
+        return {
+            "posts": serialization.rows_to_dicts(rows, names),
+            "total": total,
+            "stats": stats,
+            "next_cursor": next_cursor,
+        }
     
-    return SavedPostsResponse(posts=posts, total=total, stats=stats)
+    return await response_cache.cached_json(request, current_user.id, "saved-posts", build, raw=True)
+
+@app.get("/saved-posts/search", response_model=SearchResponse)
+async def search_saved_posts(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    results, next_cursor = await db.run_sync(search.search_posts, current_user.id, q, limit, after)
+    return SearchResponse(results=results, next_cursor=next_cursor)
 
 @app.post("/saved-posts/", response_model=SavedPostSchema)
-def create_saved_post(
+async def create_saved_post(
     post: SavedPostCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    # Convert tags list to JSON string for storage
     post_data = post.dict()
-    post_data["tags"] = json.dumps(post_data["tags"])
-    post_data["user_id"] = current_user.id
-    
     # Simple AI detection simulation
-    ai_keywords = ["job", "hiring", "opportunity", "scholarship", "deadline", "apply"]
-    post_data["ai_detected"] = any(keyword in post.title.lower() or keyword in post.summary.lower() 
-                                   for keyword in ai_keywords)
+    post_data["ai_detected"] = classifier.is_opportunity(post.title, post.summary)
     
-    db_post = SavedPost(**post_data)
-    db.add(db_post)
-    db.commit()
-    db.refresh(db_post)
+    # Saving a URL the user already has merges the tags into that post
+    [saved] = await db.run_sync(dedupe.save_posts, current_user.id, [post_data])
+    await db.commit()
+    await response_cache.bump(current_user.id)
+    retrieval.index.add_posts(current_user.id, [(saved.id, saved.title, saved.summary, saved.tags, saved.platform)])
     
+    db_post = await db.get(SavedPost, saved.id)
     # Convert back to list for response
-    db_post.tags = json.loads(db_post.tags)
+    db_post.tags = saved.tags
     return db_post
 
+@app.post("/saved-posts/bulk", response_model=BulkIngestResponse)
+async def bulk_create_saved_posts(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    # Body is a JSON array or NDJSON (one post per line), read as it streams in
+    results = await ingest.ingest_posts(db, current_user.id, request.stream())
+    await response_cache.bump(current_user.id)
+    created = sum(1 for result in results if result["status"] == "created")
+    merged = sum(1 for result in results if result["status"] == "merged")
+    return BulkIngestResponse(
+        created=created, merged=merged, failed=len(results) - created - merged, results=results
+    )
+
 @app.delete("/saved-posts/{post_id}")
-def delete_saved_post(
+async def delete_saved_post(
     post_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    post = db.query(SavedPost).filter(
-        SavedPost.id == post_id,
-        SavedPost.user_id == current_user.id
-    ).first()
+    post = (await db.execute(
+        select(SavedPost).options(selectinload(SavedPost.tag_rows)).where(
+            SavedPost.id == post_id,
+            SavedPost.user_id == current_user.id
+        )
+    )).scalar()
     
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    db.delete(post)
-    db.commit()
+    tags = [tag_row.tag for tag_row in post.tag_rows]
+    await db.run_sync(user_stats.record_posts, current_user.id, [(post.platform, tags, post.ai_detected)], sign=-1)
+    await db.delete(post)
+    await db.flush()
+    await db.run_sync(rollups.remove_posts, current_user.id, [(post.id, post.saved_at, post.platform, tags)])
+    await db.commit()
+    await response_cache.bump(current_user.id)
+    retrieval.index.remove_post(current_user.id, post_id)
     return {"message": "Post deleted successfully"}
 
 # Reminder endpoints
 @app.get("/reminders/", response_model=List[ReminderSchema])
-def get_reminders(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+async def get_reminders(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated reminder fields to return"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    names = projection(fields, REMINDER_FIELDS)
+    
+    async def build():
+        query = select(*serialization.columns(Reminder, names)).where(Reminder.user_id == current_user.id)
+        return serialization.rows_to_dicts(await db.execute(query), names)
+    
+    return await response_cache.cached_json(request, current_user.id, "reminders", build, raw=True)
+
+@app.get("/reminders/upcoming", response_model=List[ReminderSchema])
+async def get_upcoming_reminders(
+    within: int = Query(7 * 24 * 3600, ge=1, le=366 * 24 * 3600, description="Window in seconds"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    return db.query(Reminder).filter(Reminder.user_id == current_user.id).all()
+    window = timedelta(seconds=within)
+    if scheduler.scheduler.running:
+        upcoming = scheduler.scheduler.upcoming(current_user.id, window)
+        return [ReminderSchema.model_validate(reminder) for reminder in upcoming]
+    
+    # No scheduler in this process (disabled, or run by `python scheduler.py`
+    # behind several workers): answer the same window from the database
+    now = datetime.utcnow()
+    reminders = (await db.execute(
+        select(Reminder).where(
+            Reminder.user_id == current_user.id,
+            Reminder.is_completed == False,
+            Reminder.due_date > now,
+            Reminder.due_date <= now + window
+        ).order_by(Reminder.due_date, Reminder.id)
+    )).scalars().all()
+    return [ReminderSchema.model_validate(reminder) for reminder in reminders]
+
+# Longest series /analytics/trends answers in one request
+TRENDS_MAX_BUCKETS = 366
+
+# Largest ?ids= list a batch request may name
+BATCH_MAX_IDS = 1000
+
+def reminder_filter(
+    ids: Optional[List[int]] = Query(None, description="Reminder ids to act on"),
+    is_completed: Optional[bool] = Query(None, description="Only reminders in this state"),
+    due_before: Optional[datetime] = Query(None, description="Only reminders due before this time"),
+) -> list:
+    """Conditions selecting the reminders a batch request acts on, all of which must hold"""
+    if ids is None and is_completed is None and due_before is None:
+        raise HTTPException(status_code=400, detail="Give ids, is_completed or due_before")
+    conditions = []
+    if ids is not None:
+        if len(ids) > BATCH_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids per request")
+        conditions.append(Reminder.id.in_(ids))
+    if is_completed is not None:
+        conditions.append(func.coalesce(Reminder.is_completed, False) == is_completed)
+    if due_before is not None:
+        conditions.append(Reminder.due_date < due_before)
+    return conditions
+
+@app.patch("/reminders/batch", response_model=ReminderBatchResponse)
+async def update_reminders(
+    reminder_update: ReminderUpdate,
+    conditions: list = Depends(reminder_filter),
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    changes = reminder_update.dict(exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    if "due_date" in changes:
+        # A new due date is a new notification; an unchanged one keeps its state
+        changes["notified_at"] = case(
+            (Reminder.due_date == changes["due_date"], Reminder.notified_at), else_=None
+        )
+    
+    def statement(*extra):
+        return (
+            update(Reminder)
+            .where(Reminder.user_id == current_user.id, *conditions, *extra)
+            .values(**changes)
+            .returning(*Reminder.__table__.c)
+            .execution_options(synchronize_session=False)
+        )
+    
+    before = []
+    if "due_date" in changes:
+        # RETURNING only gives the new due dates; rollups need the old ones too
+        before = (await db.execute(
+            select(Reminder.id, Reminder.due_date, Reminder.is_completed)
+            .where(Reminder.user_id == current_user.id, *conditions)
+        )).all()
+    
+    if "is_completed" not in changes:
+        rows = (await db.execute(statement())).all()
+        flipped = []
+    else:
+        # Rows that change state are updated apart from the rest so the
+        # counters move by exactly that many; when only is_completed is
+        # being set, rows already in that state are left alone. Those go
+        # first, before the others join them in the target state.
+        target = bool(changes["is_completed"])
+        was_completed = func.coalesce(Reminder.is_completed, False)
+        rows = []
+        if len(changes) > 1:
+            rows = (await db.execute(statement(was_completed == target))).all()
+        flipped = (await db.execute(statement(was_completed != target))).all()
+        moved = len(flipped) if target else -len(flipped)
+        if moved:
+            await db.run_sync(user_stats.record_reminders, current_user.id, active=-moved, completed=moved)
+        rows += flipped
+    # Rollup buckets move only with the due date or the completion state
+    if "due_date" in changes:
+        after = rows
+    else:
+        before = [(row.id, row.due_date, not row.is_completed) for row in flipped]
+        after = flipped
+    await db.run_sync(
+        rollups.record_reminder_changes, current_user.id,
+        [(row[0], row[1], bool(row[2])) for row in before],
+        [(row.id, row.due_date, bool(row.is_completed)) for row in after]
+    )
+    await db.commit()
+    
+    if rows:
+        await response_cache.bump(current_user.id)
+        for row in rows:
+            retrieval.index.add_reminder(current_user.id, row)
+            scheduler.scheduler.schedule(row)
+    return ReminderBatchResponse(affected=len(rows))
+
+@app.delete("/reminders/batch", response_model=ReminderBatchResponse)
+async def delete_reminders(
+    conditions: list = Depends(reminder_filter),
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    rows = (await db.execute(
+        delete(Reminder)
+        .where(Reminder.user_id == current_user.id, *conditions)
+        .returning(Reminder.id, Reminder.due_date, Reminder.is_completed)
+        .execution_options(synchronize_session=False)
+    )).all()
+    completed = sum(1 for row in rows if row.is_completed)
+    if rows:
+        await db.run_sync(
+            user_stats.record_reminders, current_user.id, active=-(len(rows) - completed), completed=-completed
+        )
+        await db.run_sync(
+            rollups.remove_reminders, current_user.id,
+            [(row.id, row.due_date, bool(row.is_completed)) for row in rows]
+        )
+    await db.commit()
+    
+    if rows:
+        reminder_ids = [row.id for row in rows]
+        await response_cache.bump(current_user.id)
+        retrieval.index.remove_reminders(current_user.id, reminder_ids)
+        for reminder_id in reminder_ids:
+            scheduler.scheduler.unschedule(reminder_id)
+    return ReminderBatchResponse(affected=len(rows))
 
 @app.post("/reminders/", response_model=ReminderSchema)
-def create_reminder(
+async def create_reminder(
     reminder: ReminderCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
 ):
     db_reminder = Reminder(**reminder.dict(), user_id=current_user.id)
     db.add(db_reminder)
-    db.commit()
-    db.refresh(db_reminder)
+    await db.flush()
+    await db.run_sync(user_stats.record_reminders, current_user.id, active=1)
+    await db.run_sync(
+        rollups.add_reminders, current_user.id,
+        [(db_reminder.id, db_reminder.due_date, bool(db_reminder.is_completed))]
+    )
+    await db.commit()
+    await db.refresh(db_reminder)
+    await response_cache.bump(current_user.id)
+    retrieval.index.add_reminder(current_user.id, db_reminder)
+    scheduler.scheduler.schedule(db_reminder)
     return db_reminder
 
 @app.put("/reminders/{reminder_id}", response_model=ReminderSchema)
-def update_reminder(
+async def update_reminder(
     reminder_id: int,
     reminder_update: ReminderUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    reminder = db.query(Reminder).filter(
-        Reminder.id == reminder_id,
-        Reminder.user_id == current_user.id
-    ).first()
+    reminder = (await db.execute(
+        select(Reminder).where(
+            Reminder.id == reminder_id,
+            Reminder.user_id == current_user.id
+        )
+    )).scalar()
     
     if not reminder:
         raise HTTPException(status_code=404, detail="Reminder not found")
     
+    was_completed = bool(reminder.is_completed)
+    previous_due_date = reminder.due_date
     for field, value in reminder_update.dict(exclude_unset=True).items():
         setattr(reminder, field, value)
+    if reminder.due_date != previous_due_date:
+        # A new due date is a new notification
+        reminder.notified_at = None
     
-    db.commit()
-    db.refresh(reminder)
+    if bool(reminder.is_completed) != was_completed:
+        moved = 1 if reminder.is_completed else -1
+        await db.run_sync(user_stats.record_reminders, current_user.id, active=-moved, completed=moved)
+    await db.run_sync(
+        rollups.record_reminder_changes, current_user.id,
+        [(reminder.id, previous_due_date, was_completed)],
+        [(reminder.id, reminder.due_date, bool(reminder.is_completed))]
+    )
+    await db.commit()
+    await db.refresh(reminder)
+    await response_cache.bump(current_user.id)
+    retrieval.index.add_reminder(current_user.id, reminder)
+    scheduler.scheduler.schedule(reminder)
     return reminder
 
 @app.delete("/reminders/{reminder_id}")
-def delete_reminder(
+async def delete_reminder(
     reminder_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    reminder = db.query(Reminder).filter(
-        Reminder.id == reminder_id,
-        Reminder.user_id == current_user.id
-    ).first()
+    reminder = (await db.execute(
+        select(Reminder).where(
+            Reminder.id == reminder_id,
+            Reminder.user_id == current_user.id
+        )
+    )).scalar()
     
     if not reminder:
         raise HTTPException(status_code=404, detail="Reminder not found")
     
-    db.delete(reminder)
-    db.commit()
+    if reminder.is_completed:
+        await db.run_sync(user_stats.record_reminders, current_user.id, completed=-1)
+    else:
+        await db.run_sync(user_stats.record_reminders, current_user.id, active=-1)
+    await db.delete(reminder)
+    await db.flush()
+    await db.run_sync(
+        rollups.remove_reminders, current_user.id,
+        [(reminder.id, reminder.due_date, bool(reminder.is_completed))]
+    )
+    await db.commit()
+    await response_cache.bump(current_user.id)
+    retrieval.index.remove_reminders(current_user.id, [reminder_id])
+    scheduler.scheduler.unschedule(reminder_id)
     return {"message": "Reminder deleted successfully"}
 
 # Chat endpoints
 @app.get("/chat/messages/", response_model=List[ChatMessageSchema])
-def get_chat_messages(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+async def get_chat_messages(
+    request: Request,
+    before: Optional[int] = None,
+    since: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    fields: Optional[str] = Query(None, description="Comma-separated message fields to return"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    return db.query(ChatMessage).filter(
-        ChatMessage.user_id == current_user.id
-    ).order_by(ChatMessage.timestamp).all()
+    if before is not None and since is not None:
+        raise HTTPException(status_code=400, detail="Use either before or since, not both")
+    names = projection(fields, MESSAGE_FIELDS)
+    
+    async def anchor(message_id: int):
+        # Seek position (timestamp, id) of a message the client already has
+        timestamp = (await db.execute(
+            select(ChatMessage.timestamp).where(
+                ChatMessage.id == message_id,
+                ChatMessage.user_id == current_user.id
+            )
+        )).scalar()
+        if timestamp is None:
+            raise HTTPException(status_code=400, detail=f"Unknown message id {message_id}")
+        return tuple_(timestamp, message_id)
+    
+    async def build():
+        query = select(*serialization.columns(ChatMessage, names)).where(ChatMessage.user_id == current_user.id)
+        position = tuple_(ChatMessage.timestamp, ChatMessage.id)
+        
+        if since is not None:
+            # Incremental sync: everything after the newest message the client has
+            query = query.where(position > await anchor(since))
+            query = query.order_by(ChatMessage.timestamp, ChatMessage.id).limit(limit)
+            return serialization.rows_to_dicts(await db.execute(query), names)
+        
+        # Latest page, or the page before ?before=, returned oldest first
+        if before is not None:
+            query = query.where(position < await anchor(before))
+        query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit)
+        rows = (await db.execute(query)).all()
+        return serialization.rows_to_dicts(reversed(rows), names)
+    
+    return await response_cache.cached_json(request, current_user.id, "chat-messages", build, raw=True)
 
 @app.post("/chat/send/", response_model=ChatResponse)
-def send_chat_message(
+async def send_chat_message(
     message: ChatMessageCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    # Save user message
-    user_message = ChatMessage(
-        user_id=current_user.id,
-        message=message.message,
-        is_user=True
-    )
-    db.add(user_message)
-    db.commit()
-    
-    # Generate AI response (simplified)
-    ai_responses = [
-        f"I understand you're asking about '{message.message}'. Let me help you find relevant saved content.",
-        f"Based on your query about '{message.message}', I can help you organize your saved posts or set up reminders.",
-        "That's an interesting question! I can help you manage your saved content more effectively.",
-        "I'm here to help you with your saved posts and reminders. What specific assistance do you need?",
-        f"Regarding '{message.message}', I can help you categorize your content or create relevant reminders."
-    ]
-    
-    ai_response_text = random.choice(ai_responses)
-    
-    # Save AI response
-    ai_message = ChatMessage(
-        user_id=current_user.id,
-        message=ai_response_text,
-        is_user=False
-    )
-    db.add(ai_message)
-    db.commit()
+    received_at = datetime.utcnow()
+    context = await retrieval.retrieve(db, current_user.id, message.message)
+    ai_response_text = await chat.generate_reply(message.message, context)
+    
+    # Save both messages in one transaction
+    user_message, ai_message = chat.build_exchange(current_user.id, message.message, received_at, ai_response_text)
+    db.add_all([user_message, ai_message])
+    await db.commit()
+    await response_cache.bump(current_user.id)
     
     return ChatResponse(message=ai_response_text, timestamp=ai_message.timestamp)
 
+@app.post("/chat/stream")
+async def stream_chat_message(
+    message: ChatMessageCreate,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    received_at = datetime.utcnow()
+    user_id = current_user.id
+    # Retrieved up front, while the request's session is still open
+    context = await retrieval.retrieve(db, user_id, message.message)
+    
+    async def events():
+        # Tokens go out as they are generated; nothing is written until the reply is complete
+        tokens = []
+        try:
+            async for token in chat.generator.stream(message.message, context):
+                tokens.append(token)
+                yield chat.sse_event("token", {"token": token})
+        except Exception as exc:
+            yield chat.sse_event("error", {"detail": str(exc)})
+            return
+        
+        reply = "".join(tokens)
+        user_message, ai_message = chat.build_exchange(user_id, message.message, received_at, reply)
+        # The request's session is closed before the body streams, so open our own
+        async with AsyncSessionLocal() as write_db:
+            write_db.add_all([user_message, ai_message])
+            await write_db.commit()
+        await response_cache.bump(user_id)
+        
+        yield chat.sse_event("done", {
+            "user_message_id": user_message.id,
+            "message_id": ai_message.id,
+            "message": reply,
+            "timestamp": ai_message.timestamp.isoformat()
+        })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Analytics endpoint
 @app.get("/analytics/")
-def get_analytics(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+async def get_analytics(
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
 ):
-    # Get posts by platform
-    posts_by_platform = {}
-    for platform in PlatformEnum:
-        count = db.query(SavedPost).filter(
-            SavedPost.user_id == current_user.id,
-            SavedPost.platform == platform
-        ).count()
-        posts_by_platform[platform.value] = count
-    
-    # Get posts by tags
-    posts = db.query(SavedPost).filter(SavedPost.user_id == current_user.id).all()
-    tags_count = {}
-    for post in posts:
-        if post.tags:
-            tags = json.loads(post.tags) if isinstance(post.tags, str) else post.tags
-            for tag in tags:
-                tags_count[tag] = tags_count.get(tag, 0) + 1
-    
-    # Upcoming deadlines
-    upcoming_deadlines = db.query(Reminder).filter(
-        Reminder.user_id == current_user.id,
-        Reminder.due_date > datetime.utcnow(),
-        Reminder.is_completed == False
-    ).order_by(Reminder.due_date).limit(5).all()
-    
-    return {
-        "posts_by_platform": posts_by_platform,
-        "posts_by_tags": tags_count,
-        "upcoming_deadlines": len(upcoming_deadlines),
-        "total_posts": len(posts),
-        "ai_detected_posts": sum(1 for post in posts if post.ai_detected),
-        "active_reminders": db.query(Reminder).filter(
-            Reminder.user_id == current_user.id,
-            Reminder.is_completed == False
-        ).count(),
-        "completed_reminders": db.query(Reminder).filter(
-            Reminder.user_id == current_user.id,
-            Reminder.is_completed == True
-        ).count()
-    }
+    async def build():
+        # Counters come from the user_stats row; only the time-dependent
+        # upcoming count is aggregated live
+        counters = await db.run_sync(user_stats.get_user_stats, current_user.id)
+        tags_count = await db.run_sync(user_stats.get_tag_counts, current_user.id)
+        upcoming = await db.run_sync(analytics.upcoming_deadline_count, current_user.id)
+        
+        return {
+            "posts_by_platform": {
+                platform.value: counters[column]
+                for platform, column in user_stats.PLATFORM_COLUMNS.items()
+            },
+            "posts_by_tags": tags_count,
+            "upcoming_deadlines": upcoming,
+            "total_posts": counters["total_posts"],
+            "ai_detected_posts": counters["ai_detected_posts"],
+            "active_reminders": counters["active_reminders"],
+            "completed_reminders": counters["completed_reminders"]
+        }
+
+    return await response_cache.cached_json(request, current_user.id, "analytics", build, max_age=60)
+
+@app.get("/analytics/trends")
+async def get_trends(
+    request: Request,
+    granularity: str = Query("day", pattern="^(day|week)$"),
+    start: Optional[date] = Query(None, alias="from", description="First day, UTC (default: 30 days or 12 weeks back)"),
+    end: Optional[date] = Query(None, alias="to", description="Last day, UTC (default: today)"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Identity = Depends(get_current_user)
+):
+    end = end or datetime.utcnow().date()
+    if start is None:
+        start = end - (timedelta(days=29) if granularity == "day" else timedelta(weeks=11))
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if rollups.bucket_count(start, end, granularity) > TRENDS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"At most {TRENDS_MAX_BUCKETS} buckets per request")
+    
+    async def build():
+        # Answered from the rollups alone; writers keep them current
+        return await db.run_sync(rollups.trends, current_user.id, granularity, start, end)
+    
+    return await response_cache.cached_json(request, current_user.id, "trends", build, max_age=3600, raw=True)
+
+# Export endpoint
+@app.get("/export")
+async def export_library(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    include: str = "posts,reminders,chat",
+    current_user: Identity = Depends(get_current_user)
+):
+    try:
+        sections = export.parse_include(include)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    return StreamingResponse(
+        export.stream_export(current_user.id, sections, format),
+        media_type=export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="stash-export.{format}"'}
+    )
+
+# Readiness probe; answered from process state only, never the database
+@app.get("/readyz", include_in_schema=False)
+async def readiness():
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {"status": "ready"}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,234 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Log requests slower than this many milliseconds with their SQL; 0 disables
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_SQL_LIMIT = int(os.getenv("SLOW_REQUEST_SQL_LIMIT", "20"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger("stash.metrics")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered in Prometheus text format"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One slot per bucket, then +Inf, sum and count
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+            series[-3] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                lines.append(f"{self.name}_bucket{_labels(key, le=_number(bound))} {_number(count)}")
+            lines.append(f"{self.name}_sum{_labels(key)} {values[-2]!r}")
+            lines.append(f"{self.name}_count{_labels(key)} {_number(values[-1])}")
+        return lines
+
+
+def _number(value) -> str:
+    if isinstance(value, str):
+        return value
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _labels(key: Labels, **extra: str) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+REQUEST_LATENCY = Histogram("stash_http_request_duration_seconds", "Time to serve a request, by route")
+REQUEST_STATEMENTS = Histogram(
+    "stash_db_statements_per_request", "SQL statements executed per request", COUNT_BUCKETS
+)
+REQUEST_DB_TIME = Histogram("stash_db_time_per_request_seconds", "Time spent in SQL statements per request")
+POOL_WAIT = Histogram("stash_db_pool_wait_seconds", "Time to check a connection out of the pool")
+SERIALIZATION = Histogram("stash_serialization_seconds", "Time to encode JSON response bodies per request")
+
+HISTOGRAMS = [REQUEST_LATENCY, REQUEST_STATEMENTS, REQUEST_DB_TIME, POOL_WAIT, SERIALIZATION]
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_time: float = 0.0
+    pool_wait: float = 0.0
+    serialization: float = 0.0
+    # (statement, seconds), kept only when the slow-request log is on
+    sql: List[Tuple[str, float]] = field(default_factory=list)
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def render() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def serializing():
+    """Time a block that encodes a response body, charging it to the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_request.get()
+        if stats is not None:
+            stats.serialization += time.perf_counter() - started
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that reports how long rendering the body took"""
+
+    def render(self, content) -> bytes:
+        with serializing():
+            return super().render(content)
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Attach statement timing and pool-wait timing to a sync or async engine"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_request.get()
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - context._metrics_started
+        stats.statements += 1
+        stats.db_time += elapsed
+        if SLOW_REQUEST_MS:
+            stats.sql.append((statement, elapsed))
+
+    _time_pool_checkouts(sync_engine.pool, name)
+
+    @event.listens_for(sync_engine, "engine_disposed")
+    def engine_disposed(engine):
+        # dispose() swaps in a fresh pool
+        _time_pool_checkouts(engine.pool, name)
+
+
+def _time_pool_checkouts(pool, name: str) -> None:
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            elapsed = time.perf_counter() - started
+            POOL_WAIT.observe(elapsed, engine=name)
+            stats = current_request.get()
+            if stats is not None:
+                stats.pool_wait += elapsed
+
+    pool.connect = timed_connect
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are timed to their last chunk"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        stats_token = current_request.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(stats_token)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            labels = {"method": scope["method"], "route": path}
+            REQUEST_LATENCY.observe(elapsed, status=str(status_code), **labels)
+            REQUEST_STATEMENTS.observe(stats.statements, **labels)
+            REQUEST_DB_TIME.observe(stats.db_time, **labels)
+            if stats.serialization:
+                SERIALIZATION.observe(stats.serialization, **labels)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                log_slow_request(scope, status_code, elapsed, stats)
+
+
+def log_slow_request(scope, status_code: int, elapsed: float, stats: RequestStats) -> None:
+    # Identical statements are grouped, so an N+1 loop shows up as one line with a count
+    totals: Dict[str, float] = {}
+    counts: Counter = Counter()
+    for statement, seconds in stats.sql:
+        text = " ".join(statement.split())
+        counts[text] += 1
+        totals[text] = totals.get(text, 0.0) + seconds
+    statements = sorted(counts, key=lambda text: totals[text], reverse=True)[:SLOW_REQUEST_SQL_LIMIT]
+    lines = [
+        f"  {counts[text]}x {totals[text] * 1000:.1f} ms  {text}"
+        for text in statements
+    ]
+    logger.warning(
+        "Slow request %s %s -> %s in %.1f ms: %d statements, %.1f ms in SQL, "
+        "%.1f ms waiting for connections, %.1f ms serializing\n%s",
+        scope["method"], scope["path"], status_code, elapsed * 1000, stats.statements,
+        stats.db_time * 1000, stats.pool_wait * 1000, stats.serialization * 1000, "\n".join(lines)
+    )
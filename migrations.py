@@ -0,0 +1,251 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import select, exists, not_, or_, text, inspect, Index
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import dedupe
+import rollups
+import stats as user_stats
+from models import (
+    Base, SavedPost, PostTag, PostDailyRollup, ReminderDailyRollup, IdempotencyKey, SchemaMigration
+)
+from tags import unique_tags, load_tags
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_post_tags(db: Session, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """Populate post_tags from the JSON tag strings of posts that have no tag rows yet"""
+    created = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(SavedPost.id, SavedPost.user_id, SavedPost.tags)
+            .where(
+                SavedPost.id > last_id,
+                SavedPost.tags.is_not(None),
+                not_(or_(SavedPost.tags == "", SavedPost.tags == "[]")),
+                ~exists().where(PostTag.post_id == SavedPost.id),
+            )
+            .order_by(SavedPost.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        
+        for post_id, user_id, raw_tags in rows:
+            for tag in unique_tags(load_tags(raw_tags)):
+                db.add(PostTag(post_id=post_id, user_id=user_id, tag=tag))
+                created += 1
+        db.commit()
+        last_id = rows[-1].id
+    return created
+
+
+# External-content FTS5 index over saved_posts, kept in sync by triggers so
+# every write path (ORM, Core, raw SQL) updates it in the same transaction
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE saved_posts_fts USING fts5(
+        title, summary, tags,
+        content='saved_posts', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS saved_posts_fts_insert AFTER INSERT ON saved_posts BEGIN
+        INSERT INTO saved_posts_fts(rowid, title, summary, tags)
+        VALUES (new.id, new.title, new.summary, new.tags);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS saved_posts_fts_delete AFTER DELETE ON saved_posts BEGIN
+        INSERT INTO saved_posts_fts(saved_posts_fts, rowid, title, summary, tags)
+        VALUES ('delete', old.id, old.title, old.summary, old.tags);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS saved_posts_fts_update AFTER UPDATE OF title, summary, tags ON saved_posts BEGIN
+        INSERT INTO saved_posts_fts(saved_posts_fts, rowid, title, summary, tags)
+        VALUES ('delete', old.id, old.title, old.summary, old.tags);
+        INSERT INTO saved_posts_fts(rowid, title, summary, tags)
+        VALUES (new.id, new.title, new.summary, new.tags);
+    END
+    """,
+]
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """Create the FTS5 search index on SQLite, indexing existing posts once"""
+    if engine.dialect.name != "sqlite":
+        return False
+    
+    with engine.begin() as conn:
+        exists_already = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'saved_posts_fts'"
+        )).first()
+        if exists_already:
+            return True
+        try:
+            for statement in SEARCH_INDEX_DDL:
+                conn.execute(text(statement))
+        except OperationalError:
+            # SQLite built without FTS5; search stays unavailable
+            return False
+        conn.execute(text("INSERT INTO saved_posts_fts(saved_posts_fts) VALUES ('rebuild')"))
+    return True
+
+
+# Versioned migrations
+#
+# Each step is idempotent, so a database that already has part of a step
+# (created by create_all or by an earlier release) is upgraded safely.
+# Append new steps with the next version number; never edit an applied one.
+
+def add_column(engine: Engine, table_name: str, column_name: str) -> bool:
+    """ALTER in a column declared on the models, if the table does not have it yet"""
+    if column_name in {column["name"] for column in inspect(engine).get_columns(table_name)}:
+        return False
+    column = Base.metadata.tables[table_name].c[column_name]
+    column_type = column.type.compile(dialect=engine.dialect)
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN "{column_name}" {column_type}'))
+    return True
+
+
+def create_index(engine: Engine, table_name: str, name: str, *columns: str, unique: bool = False) -> None:
+    table = Base.metadata.tables[table_name]
+    Index(name, *(table.c[column] for column in columns), unique=unique).create(bind=engine, checkfirst=True)
+
+
+def _with_session(step: Callable[[Session], object]) -> Callable[[Engine], None]:
+    def run(engine: Engine) -> None:
+        db = Session(bind=engine)
+        try:
+            step(db)
+        finally:
+            db.close()
+    return run
+
+
+def _base_schema(engine: Engine) -> None:
+    Base.metadata.create_all(bind=engine)
+
+
+def _timeline_indexes(engine: Engine) -> None:
+    create_index(engine, "saved_posts", "ix_saved_posts_user_saved_at_id", "user_id", "saved_at", "id")
+    create_index(engine, "post_tags", "ix_post_tags_user_tag", "user_id", "tag")
+    create_index(engine, "chat_messages", "ix_chat_messages_user_timestamp", "user_id", "timestamp")
+
+
+def _reminder_notifications(engine: Engine) -> None:
+    add_column(engine, "reminders", "notified_at")
+    create_index(engine, "reminders", "ix_reminders_is_completed_due_date", "is_completed", "due_date")
+
+
+def _hot_query_indexes(engine: Engine) -> None:
+    create_index(engine, "reminders", "ix_reminders_user_completed_due", "user_id", "is_completed", "due_date")
+    create_index(engine, "saved_posts", "ix_saved_posts_user_platform", "user_id", "platform")
+    with engine.begin() as conn:
+        # Refresh planner statistics for the new indexes
+        conn.execute(text("ANALYZE"))
+
+
+def _daily_rollups(engine: Engine) -> None:
+    PostDailyRollup.__table__.create(bind=engine, checkfirst=True)
+    ReminderDailyRollup.__table__.create(bind=engine, checkfirst=True)
+    _with_session(rollups.catch_up)(engine)
+
+
+def _saved_post_url_hashes(engine: Engine) -> None:
+    add_column(engine, "saved_posts", "url_hash")
+    # Every existing row is NULL here, so the index builds before the job merges duplicates
+    create_index(engine, "saved_posts", "ux_saved_posts_user_url_hash", "user_id", "url_hash", unique=True)
+    _with_session(dedupe.collapse_duplicates)(engine)
+
+
+def _idempotency_keys(engine: Engine) -> None:
+    IdempotencyKey.__table__.create(bind=engine, checkfirst=True)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Engine], object]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base schema", _base_schema),
+    Migration(2, "timeline and tag indexes", _timeline_indexes),
+    Migration(3, "backfill post_tags", _with_session(backfill_post_tags)),
+    Migration(4, "saved_posts full-text index", ensure_search_index),
+    Migration(5, "backfill user_stats", _with_session(user_stats.backfill_user_stats)),
+    Migration(6, "reminder notifications", _reminder_notifications),
+    Migration(7, "hot query indexes", _hot_query_indexes),
+    Migration(8, "daily rollups", _daily_rollups),
+    Migration(9, "saved post url hashes", _saved_post_url_hashes),
+    Migration(10, "idempotency keys", _idempotency_keys),
+]
+
+
+def applied_versions(engine: Engine) -> Dict[int, SchemaMigration]:
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    db = Session(bind=engine)
+    try:
+        return {migration.version: migration for migration in db.execute(select(SchemaMigration)).scalars()}
+    finally:
+        db.close()
+
+
+def pending_migrations(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    applied = applied_versions(engine)
+    return [
+        migration for migration in MIGRATIONS
+        if migration.version not in applied and (target is None or migration.version <= target)
+    ]
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """Apply every pending migration in version order and record each one"""
+    applied = []
+    for migration in pending_migrations(engine, target):
+        migration.upgrade(engine)
+        db = Session(bind=engine)
+        try:
+            # Another process may have applied it meanwhile; the steps are idempotent
+            if db.get(SchemaMigration, migration.version) is None:
+                db.add(SchemaMigration(version=migration.version, name=migration.name))
+                db.commit()
+        finally:
+            db.close()
+        applied.append(migration)
+    return applied
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+    
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = subcommands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, default=None, help="stop after this version")
+    subcommands.add_parser("status", help="list applied and pending migrations")
+    args = parser.parse_args()
+    
+    if args.command == "upgrade":
+        for migration in upgrade(engine, args.to):
+            print(f"Applied {migration.version}: {migration.name}")
+        print(f"Schema is at version {max(applied_versions(engine), default=0)}")
+    else:
+        applied = applied_versions(engine)
+        for migration in MIGRATIONS:
+            if migration.version in applied:
+                state = f"applied {applied[migration.version].applied_at:%Y-%m-%d %H:%M:%S}"
+            else:
+                state = "pending"
+            print(f"{migration.version:>4}  {migration.name:<32} {state}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, Text, LargeBinary, ForeignKey, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -25,6 +25,18 @@ class User(Base):
     saved_posts = relationship("SavedPost", back_populates="user")
     reminders = relationship("Reminder", back_populates="user")
     chat_messages = relationship("ChatMessage", back_populates="user")
+    api_tokens = relationship("ApiToken", back_populates="user")
+
+class ApiToken(Base):
+    __tablename__ = "api_tokens"
+    
+    # Only the SHA-256 of a bearer token is stored
+    token_hash = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    user = relationship("User", back_populates="api_tokens")
 
 class SavedPost(Base):
     __tablename__ = "saved_posts"
@@ -40,12 +52,45 @@ class SavedPost(Base):
     deadline = Column(DateTime, nullable=True)
     ai_detected = Column(Boolean, default=False)
     original_url = Column(String, nullable=True)
+    # dedupe.url_hash of original_url; NULL when the post has no link
+    url_hash = Column(String, nullable=True)
+    
+    # Keyset pagination seeks on (saved_at, id) within a user's library
+    __table_args__ = (
+        Index("ix_saved_posts_user_saved_at_id", "user_id", "saved_at", "id"),
+        # Per-user platform aggregates (stats rebuild and verify)
+        Index("ix_saved_posts_user_platform", "user_id", "platform"),
+        # One post per normalized URL; saving it again merges into that post
+        Index("ux_saved_posts_user_url_hash", "user_id", "url_hash", unique=True),
+    )
     
     # Relationships
     user = relationship("User", back_populates="saved_posts")
+    tag_rows = relationship("PostTag", back_populates="post", cascade="all, delete-orphan")
+
+class PostTag(Base):
+    __tablename__ = "post_tags"
+    
+    post_id = Column(Integer, ForeignKey("saved_posts.id"), primary_key=True)
+    tag = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # Category filtering and tag counts look up (user_id, tag)
+    __table_args__ = (
+        Index("ix_post_tags_user_tag", "user_id", "tag"),
+    )
+    
+    # Relationships
+    post = relationship("SavedPost", back_populates="tag_rows")
 
 class Reminder(Base):
     __tablename__ = "reminders"
+    __table_args__ = (
+        # Pending reminders in due order, for the scheduler
+        Index("ix_reminders_is_completed_due_date", "is_completed", "due_date"),
+        # Per-user listings and active/upcoming counts
+        Index("ix_reminders_user_completed_due", "user_id", "is_completed", "due_date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -55,6 +100,8 @@ class Reminder(Base):
     is_completed = Column(Boolean, default=False)
     is_urgent = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Set when the scheduler claims the reminder for notification
+    notified_at = Column(DateTime, nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="reminders")
@@ -68,5 +115,84 @@ class ChatMessage(Base):
     is_user = Column(Boolean)  # True if from user, False if from AI
     timestamp = Column(DateTime, default=datetime.utcnow)
     
+    # History pages seek on (timestamp, id) within a user's conversation
+    __table_args__ = (
+        Index("ix_chat_messages_user_timestamp", "user_id", "timestamp"),
+    )
+    
     # Relationships
     user = relationship("User", back_populates="chat_messages")
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_posts = Column(Integer, default=0, nullable=False)
+    ai_detected_posts = Column(Integer, default=0, nullable=False)
+    linkedin_posts = Column(Integer, default=0, nullable=False)
+    instagram_posts = Column(Integer, default=0, nullable=False)
+    youtube_posts = Column(Integer, default=0, nullable=False)
+    twitter_posts = Column(Integer, default=0, nullable=False)
+    active_reminders = Column(Integer, default=0, nullable=False)
+    completed_reminders = Column(Integer, default=0, nullable=False)
+
+class UserTagStats(Base):
+    __tablename__ = "user_tag_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    tag = Column(String, primary_key=True)
+    post_count = Column(Integer, default=0, nullable=False)
+
+class PostDailyRollup(Base):
+    __tablename__ = "post_daily_rollups"
+    
+    # Posts saved per UTC day and platform; tag "" counts every post once,
+    # other rows count the posts carrying that tag. Maintained by rollups.py.
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    platform = Column(Enum(PlatformEnum), primary_key=True)
+    tag = Column(String, primary_key=True)
+    saves = Column(Integer, default=0, nullable=False)
+
+class ReminderDailyRollup(Base):
+    __tablename__ = "reminder_daily_rollups"
+    
+    # Reminders per UTC due day, and how many of those are completed
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    due = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    # Stored response of a POST sent with an Idempotency-Key header, per API token
+    token_hash = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    # Method and path the key was first used with
+    fingerprint = Column(String, nullable=False)
+    # NULL while the first request is still being processed
+    status_code = Column(Integer, nullable=True)
+    headers = Column(Text, nullable=True)  # JSON list of [name, value]
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+
+class AppState(Base):
+    __tablename__ = "app_state"
+    
+    # Small key/value store for job bookkeeping (rule fingerprints, watermarks)
+    key = Column(String, primary_key=True)
+    value = Column(String)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    # One row per migration applied by migrations.upgrade
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,261 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import SavedPost, Reminder
+from tags import load_tags
+
+# Upper bound on postings held across every user's index before LRU eviction
+RETRIEVAL_MAX_POSTINGS = int(os.getenv("RETRIEVAL_MAX_POSTINGS", "2000000"))
+# Indexes older than this are rebuilt, picking up writes made by other workers
+RETRIEVAL_TTL = float(os.getenv("RETRIEVAL_TTL", "600"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from have how i in is it me my
+    of on or our so that the their this to was we what when where which who why
+    will with you your about any some
+""".split())
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# ("post" | "reminder", id)
+DocKey = Tuple[str, int]
+
+
+@dataclass
+class Document:
+    key: DocKey
+    title: str
+    length: int
+    detail: dict
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def post_document(post_id: int, title: str, summary: str, tags: Iterable[str], platform=None) -> Tuple[Document, Counter]:
+    tags = list(tags)
+    terms = Counter(tokenize(f"{title or ''} {summary or ''} {' '.join(tags)}"))
+    detail = {"id": post_id, "title": title, "tags": tags}
+    if platform is not None:
+        detail["platform"] = getattr(platform, "value", platform)
+    return Document(("post", post_id), title, sum(terms.values()), detail), terms
+
+
+def reminder_document(reminder_id: int, title: str, description: str, due_date, is_completed: bool) -> Tuple[Document, Counter]:
+    terms = Counter(tokenize(f"{title or ''} {description or ''}"))
+    detail = {"id": reminder_id, "title": title, "due_date": due_date, "is_completed": bool(is_completed)}
+    return Document(("reminder", reminder_id), title, sum(terms.values()), detail), terms
+
+
+class UserIndex:
+    """Inverted index over one user's posts and reminders"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[DocKey, int]] = {}
+        self.documents: Dict[DocKey, Document] = {}
+        self.terms: Dict[DocKey, Counter] = {}
+        self.total_length = 0
+        self.built_at = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return sum(len(terms) for terms in self.terms.values())
+
+    def add(self, document: Document, terms: Counter) -> int:
+        """Index a document, replacing any previous version; returns the change in postings"""
+        delta = -self.remove(document.key)
+        self.documents[document.key] = document
+        self.terms[document.key] = terms
+        self.total_length += document.length
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[document.key] = frequency
+        return delta + len(terms)
+
+    def remove(self, key: DocKey) -> int:
+        document = self.documents.pop(key, None)
+        if document is None:
+            return 0
+        terms = self.terms.pop(key)
+        self.total_length -= document.length
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+        return len(terms)
+
+    def search(self, query: str, k: int) -> List[Tuple[float, Document]]:
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.documents:
+            return []
+
+        count = len(self.documents)
+        average_length = self.total_length / count or 1.0
+        scores: Dict[DocKey, float] = {}
+        for term in query_terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                length = self.documents[key].length
+                weight = frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+                scores[key] = scores.get(key, 0.0) + idf * weight
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(score, self.documents[key]) for key, score in ranked]
+
+
+def load_user_documents(db: Session, user_id: int) -> List[Tuple[Document, Counter]]:
+    """Every post and reminder of the user, as documents ready for indexing"""
+    documents = [
+        post_document(row.id, row.title, row.summary, load_tags(row.tags), row.platform)
+        for row in db.execute(
+            select(SavedPost.id, SavedPost.title, SavedPost.summary, SavedPost.tags, SavedPost.platform)
+            .where(SavedPost.user_id == user_id)
+        )
+    ]
+    documents.extend(
+        reminder_document(row.id, row.title, row.description, row.due_date, row.is_completed)
+        for row in db.execute(
+            select(Reminder.id, Reminder.title, Reminder.description, Reminder.due_date, Reminder.is_completed)
+            .where(Reminder.user_id == user_id)
+        )
+    )
+    return documents
+
+
+class RetrievalIndex:
+    """Per-user indexes built lazily, kept current by write hooks, evicted LRU"""
+
+    def __init__(self, max_postings: int = RETRIEVAL_MAX_POSTINGS, ttl: float = RETRIEVAL_TTL):
+        self.max_postings = max_postings
+        self.ttl = ttl
+        self.users: "OrderedDict[int, UserIndex]" = OrderedDict()
+        self.sizes: Dict[int, int] = {}
+        self.total_postings = 0
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # Writes that arrived while a user's index was being built
+        self._building: Dict[int, List[Callable[[UserIndex], int]]] = {}
+
+    def loaded(self, user_id: int) -> Optional[UserIndex]:
+        index = self.users.get(user_id)
+        if index is not None and time.monotonic() - index.built_at > self.ttl:
+            self.evict(user_id)
+            return None
+        return index
+
+    async def ensure(
+        self, user_id: int, load: Callable[[int], Awaitable[List[Tuple[Document, Counter]]]]
+    ) -> UserIndex:
+        index = self.loaded(user_id)
+        if index is None:
+            lock = self._locks.setdefault(user_id, asyncio.Lock())
+            async with lock:
+                index = self.loaded(user_id)
+                if index is None:
+                    index = UserIndex()
+                    self._building[user_id] = []
+                    try:
+                        for document, terms in await load(user_id):
+                            index.add(document, terms)
+                        # Replay writes made during the load; adds and removes are idempotent
+                        for change in self._building[user_id]:
+                            change(index)
+                    finally:
+                        del self._building[user_id]
+                    self._store(user_id, index)
+        self.users.move_to_end(user_id)
+        return index
+
+    def evict(self, user_id: int) -> None:
+        if self.users.pop(user_id, None) is not None:
+            self.total_postings -= self.sizes.pop(user_id, 0)
+        # A held lock is still guarding a build; it goes with the next eviction
+        lock = self._locks.get(user_id)
+        if lock is not None and not lock.locked():
+            del self._locks[user_id]
+
+    def _store(self, user_id: int, index: UserIndex) -> None:
+        self.evict(user_id)
+        self.users[user_id] = index
+        self.sizes[user_id] = index.size
+        self.total_postings += self.sizes[user_id]
+        self._shrink(keep=user_id)
+
+    def _shrink(self, keep: int) -> None:
+        while self.total_postings > self.max_postings and len(self.users) > 1:
+            oldest = next(iter(self.users))
+            if oldest == keep:
+                self.users.move_to_end(keep)
+                oldest = next(iter(self.users))
+            self.evict(oldest)
+
+    def _apply(self, user_id: int, change: Callable[[UserIndex], int]) -> None:
+        # Unloaded users pick the change up when their index is first built
+        index = self.users.get(user_id)
+        if index is None:
+            if user_id in self._building:
+                self._building[user_id].append(change)
+            return
+        delta = change(index)
+        self.sizes[user_id] += delta
+        self.total_postings += delta
+        self._shrink(keep=user_id)
+
+    def add_posts(self, user_id: int, posts: Iterable[Tuple[int, str, str, Iterable[str], object]]) -> None:
+        posts = list(posts)
+        self._apply(user_id, lambda index: sum(index.add(*post_document(*post)) for post in posts))
+
+    def remove_post(self, user_id: int, post_id: int) -> None:
+        self._apply(user_id, lambda index: -index.remove(("post", post_id)))
+
+    def add_reminder(self, user_id: int, reminder) -> None:
+        document = reminder_document(
+            reminder.id, reminder.title, reminder.description, reminder.due_date, reminder.is_completed
+        )
+        self._apply(user_id, lambda index: index.add(*document))
+
+    def remove_reminders(self, user_id: int, reminder_ids: Iterable[int]) -> None:
+        reminder_ids = list(reminder_ids)
+        self._apply(user_id, lambda index: -sum(index.remove(("reminder", reminder_id)) for reminder_id in reminder_ids))
+
+
+index = RetrievalIndex()
+
+
+async def retrieve(db: AsyncSession, user_id: int, query: str, k: int = RETRIEVAL_TOP_K) -> dict:
+    """Top-k posts and reminders for a chat message, as context for the reply generator
+
+    Only the first message after a (re)build reads the database; later ones are
+    answered from the in-memory index.
+    """
+    async def load(user_id: int):
+        return await db.run_sync(load_user_documents, user_id)
+
+    user_index = await index.ensure(user_id, load)
+    context = {"posts": [], "reminders": []}
+    for score, document in user_index.search(query, k * 2):
+        kind = "posts" if document.key[0] == "post" else "reminders"
+        if len(context[kind]) < k:
+            context[kind].append({**document.detail, "score": round(score, 4)})
+    return context
@@ -0,0 +1,461 @@
+import logging
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, String, cast, delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from models import AppState, PlatformEnum, PostDailyRollup, PostTag, Reminder, ReminderDailyRollup, SavedPost
+
+# Daily rollups behind /analytics/trends
+#
+# Writers count the posts and reminders they add in their own transaction
+# and move a per-table watermark past them; changes to rows at or below the
+# watermark (deletes, completion and due-date changes) adjust the buckets the
+# same way. catch_up folds every source row above the watermark, for rows
+# written outside the API (imports, seeding); it runs at startup and from the
+# CLI. After deletes the watermark is clamped to the highest id left, so an
+# id SQLite hands out again is always above it.
+
+# Source ids folded per catch-up transaction
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "20000"))
+
+# app_state keys holding the highest source id already counted
+POSTS_WATERMARK = "rollups.saved_posts"
+REMINDERS_WATERMARK = "rollups.reminders"
+
+# Tag of the rows counting every post once, whatever its tags
+ALL_POSTS = ""
+
+GRANULARITIES = {"day": 1, "week": 7}
+
+logger = logging.getLogger("stash.rollups")
+
+# (id, saved_at, platform, tags) of a post leaving the rollups
+PostFacts = Tuple[int, Optional[datetime], Optional[PlatformEnum], Iterable[str]]
+# (id, due_date, is_completed) of a reminder before or after a write
+ReminderFacts = Tuple[int, Optional[datetime], bool]
+
+POST_KEYS = ("user_id", "day", "platform", "tag")
+REMINDER_KEYS = ("user_id", "day")
+
+
+def _day(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    # SQLite's date() returns text
+    return date.fromisoformat(value[:10])
+
+
+def _upsert(db: Session, model, keys: Tuple[str, ...], rows: List[dict]) -> None:
+    """Add each row's counts to its bucket, creating buckets that do not exist yet"""
+    if not rows:
+        return
+    table = model.__table__
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            column: table.c[column] + statement.excluded[column]
+            for column in rows[0] if column not in keys
+        },
+    )
+    db.execute(statement, rows)
+
+
+def _add_posts(db: Session, counts: Counter) -> None:
+    _upsert(db, PostDailyRollup, POST_KEYS, [
+        {"user_id": user_id, "day": day, "platform": platform, "tag": tag, "saves": saves}
+        for (user_id, day, platform, tag), saves in counts.items() if saves
+    ])
+
+
+def _add_reminders(db: Session, counts: Dict[Tuple[int, date], Counter]) -> None:
+    _upsert(db, ReminderDailyRollup, REMINDER_KEYS, [
+        {"user_id": user_id, "day": day, "due": values["due"], "completed": values["completed"]}
+        for (user_id, day), values in counts.items() if values["due"] or values["completed"]
+    ])
+
+
+def _watermark(db: Session, key: str) -> int:
+    value = db.execute(select(AppState.value).where(AppState.key == key)).scalar()
+    return int(value) if value else 0
+
+
+def _clamp_watermark(db: Session, key: str, model) -> None:
+    newest = select(func.coalesce(func.max(model.id), 0)).scalar_subquery()
+    db.execute(
+        update(AppState)
+        .where(AppState.key == key, cast(AppState.value, Integer) > newest)
+        .values(value=cast(newest, String))
+    )
+
+
+# Catch-up
+
+def _fold_posts(db: Session, low: int, high: int) -> None:
+    in_range = (
+        SavedPost.id > low, SavedPost.id <= high,
+        SavedPost.saved_at.is_not(None), SavedPost.platform.is_not(None),
+    )
+    day = func.date(SavedPost.saved_at)
+    counts: Counter = Counter()
+    for user_id, saved_on, platform, saves in db.execute(
+        select(SavedPost.user_id, day, SavedPost.platform, func.count())
+        .where(*in_range)
+        .group_by(SavedPost.user_id, day, SavedPost.platform)
+    ):
+        counts[(user_id, _day(saved_on), platform, ALL_POSTS)] += saves
+    for user_id, saved_on, platform, tag, saves in db.execute(
+        select(SavedPost.user_id, day, SavedPost.platform, PostTag.tag, func.count())
+        .join(PostTag, PostTag.post_id == SavedPost.id)
+        .where(*in_range)
+        .group_by(SavedPost.user_id, day, SavedPost.platform, PostTag.tag)
+    ):
+        counts[(user_id, _day(saved_on), platform, tag)] += saves
+    _add_posts(db, counts)
+
+
+def _fold_reminders(db: Session, low: int, high: int) -> None:
+    day = func.date(Reminder.due_date)
+    counts: Dict[Tuple[int, date], Counter] = {}
+    for user_id, due_on, due, completed in db.execute(
+        select(Reminder.user_id, day, func.count(), func.count().filter(Reminder.is_completed == True))
+        .where(Reminder.id > low, Reminder.id <= high, Reminder.due_date.is_not(None))
+        .group_by(Reminder.user_id, day)
+    ):
+        counts[(user_id, _day(due_on))] = Counter(due=due, completed=completed)
+    _add_reminders(db, counts)
+
+
+def _catch_up(db: Session, key: str, model, fold, batch_size: int) -> int:
+    while True:
+        newest, stored = db.execute(select(
+            select(func.max(model.id)).scalar_subquery(),
+            select(AppState.value).where(AppState.key == key).scalar_subquery(),
+        )).one()
+        low = int(stored) if stored else 0
+        if newest is None or newest <= low:
+            db.rollback()
+            return low
+
+        high = min(newest, low + batch_size)
+        try:
+            # Claim the id range before folding it; a concurrent catch-up
+            # loses the compare-and-set and re-reads the watermark
+            if stored is None:
+                db.add(AppState(key=key, value=str(high)))
+                db.flush()
+            elif db.execute(
+                update(AppState)
+                .where(AppState.key == key, AppState.value == stored)
+                .values(value=str(high))
+            ).rowcount != 1:
+                db.rollback()
+                continue
+            fold(db, low, high)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+        except OperationalError as exc:
+            # Another writer holds the database; the next catch-up resumes here
+            db.rollback()
+            logger.warning("Rollup catch-up of %s stopped at id %d: %s", model.__tablename__, low, exc)
+            return low
+
+
+def catch_up(db: Session, batch_size: int = ROLLUP_BATCH_SIZE) -> Dict[str, int]:
+    """Fold posts and reminders above the watermarks into the rollups, committing per batch
+
+    Returns the watermark of each source table afterwards.
+    """
+    return {
+        "saved_posts": _catch_up(db, POSTS_WATERMARK, SavedPost, _fold_posts, batch_size),
+        "reminders": _catch_up(db, REMINDERS_WATERMARK, Reminder, _fold_reminders, batch_size),
+    }
+
+
+def rebuild(db: Session, batch_size: int = ROLLUP_BATCH_SIZE) -> Dict[str, int]:
+    """Drop every rollup and watermark, then count the source tables again"""
+    db.execute(delete(PostDailyRollup))
+    db.execute(delete(ReminderDailyRollup))
+    db.execute(delete(AppState).where(AppState.key.in_([POSTS_WATERMARK, REMINDERS_WATERMARK])))
+    db.commit()
+    return catch_up(db, batch_size)
+
+
+# Write-path adjustments; the caller commits
+
+def _set_watermark(db: Session, key: str, value: int) -> None:
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = insert(AppState).values(key=key, value=str(value), updated_at=datetime.utcnow())
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"value": statement.excluded.value, "updated_at": statement.excluded.updated_at},
+    ))
+
+
+def _count_new(db: Session, key: str, model, fold, new_ids: List[int], add) -> None:
+    """Count rows the caller just inserted and move the watermark past them
+
+    When nothing uncounted lies between the watermark and the new ids, the
+    rows are counted from what the caller holds (`add`); otherwise the whole
+    range is folded from the table, as catch_up would. The caller's INSERT
+    holds the write lock, so no other writer moves the watermark meanwhile.
+    """
+    if not new_ids:
+        return
+    high = max(new_ids)
+    watermark = func.coalesce(
+        select(cast(AppState.value, Integer)).where(AppState.key == key).scalar_subquery(), 0
+    )
+    low, uncounted = db.execute(select(
+        watermark,
+        select(func.count()).select_from(model).where(model.id > watermark, model.id <= high).scalar_subquery(),
+    )).one()
+    if high <= low:
+        return
+    own = {row_id for row_id in new_ids if row_id > low}
+    if uncounted == len(own):
+        add(own)
+    else:
+        fold(db, low, high)
+    _set_watermark(db, key, high)
+
+
+def add_posts(db: Session, user_id: int, posts: Iterable[PostFacts]) -> None:
+    """Count newly inserted posts; call after the INSERT has been flushed"""
+    posts = list(posts)
+
+    def add(post_ids):
+        counts: Counter = Counter()
+        for post_id, saved_at, platform, tags in posts:
+            if post_id not in post_ids or saved_at is None or platform is None:
+                continue
+            day = _day(saved_at)
+            counts[(user_id, day, platform, ALL_POSTS)] += 1
+            for tag in set(tags):
+                counts[(user_id, day, platform, tag)] += 1
+        _add_posts(db, counts)
+
+    _count_new(db, POSTS_WATERMARK, SavedPost, _fold_posts, [post[0] for post in posts], add)
+
+
+def add_reminders(db: Session, user_id: int, reminders: Iterable[ReminderFacts]) -> None:
+    """Count newly inserted reminders; call after the INSERT has been flushed"""
+    reminders = list(reminders)
+
+    def add(reminder_ids):
+        counts: Dict[Tuple[int, date], Counter] = defaultdict(Counter)
+        for reminder_id, due_date, is_completed in reminders:
+            if reminder_id not in reminder_ids or due_date is None:
+                continue
+            counts[(user_id, _day(due_date))]["due"] += 1
+            if is_completed:
+                counts[(user_id, _day(due_date))]["completed"] += 1
+        _add_reminders(db, counts)
+
+    _count_new(db, REMINDERS_WATERMARK, Reminder, _fold_reminders, [reminder[0] for reminder in reminders], add)
+
+
+def remove_posts(db: Session, user_id: int, posts: Iterable[PostFacts]) -> None:
+    """Take deleted posts out of their buckets; call after the DELETE has been flushed"""
+    posts = [post for post in posts if post[1] is not None and post[2] is not None]
+    if posts:
+        watermark = _watermark(db, POSTS_WATERMARK)
+        counts: Counter = Counter()
+        for post_id, saved_at, platform, tags in posts:
+            if post_id > watermark:
+                # Never folded in; catch_up will not see it either
+                continue
+            day = _day(saved_at)
+            counts[(user_id, day, platform, ALL_POSTS)] -= 1
+            for tag in set(tags):
+                counts[(user_id, day, platform, tag)] -= 1
+        _add_posts(db, counts)
+    _clamp_watermark(db, POSTS_WATERMARK, SavedPost)
+
+
+def add_post_tags(db: Session, user_id: int, posts: Iterable[PostFacts]) -> None:
+    """Count tags that existing posts gained, e.g. when a URL is saved again"""
+    posts = [post for post in posts if post[1] is not None and post[2] is not None and post[3]]
+    if not posts:
+        return
+    watermark = _watermark(db, POSTS_WATERMARK)
+    counts: Counter = Counter()
+    for post_id, saved_at, platform, tags in posts:
+        if post_id > watermark:
+            # catch_up will count the post with all of its tags
+            continue
+        for tag in set(tags):
+            counts[(user_id, _day(saved_at), platform, tag)] += 1
+    _add_posts(db, counts)
+
+
+def record_reminder_changes(
+    db: Session, user_id: int, before: Iterable[ReminderFacts], after: Iterable[ReminderFacts]
+) -> None:
+    """Move reminders between buckets when their due date or completion changed"""
+    changes: Dict[int, Counter] = defaultdict(Counter)
+    for sign, facts in ((-1, before), (1, after)):
+        for reminder_id, due_date, is_completed in facts:
+            if due_date is None:
+                continue
+            day = _day(due_date)
+            changes[reminder_id][(day, "due")] += sign
+            if is_completed:
+                changes[reminder_id][(day, "completed")] += sign
+    changes = {
+        reminder_id: delta for reminder_id, delta in changes.items()
+        if any(delta.values())
+    }
+    if not changes:
+        return
+
+    watermark = _watermark(db, REMINDERS_WATERMARK)
+    counts: Dict[Tuple[int, date], Counter] = defaultdict(Counter)
+    for reminder_id, delta in changes.items():
+        if reminder_id > watermark:
+            continue
+        for (day, column), value in delta.items():
+            counts[(user_id, day)][column] += value
+    _add_reminders(db, counts)
+
+
+def remove_reminders(db: Session, user_id: int, reminders: Iterable[ReminderFacts]) -> None:
+    """Take deleted reminders out of their buckets; call after the DELETE has been flushed"""
+    record_reminder_changes(db, user_id, reminders, [])
+    _clamp_watermark(db, REMINDERS_WATERMARK, Reminder)
+
+
+# Reads
+
+def bucket_start(day: date, granularity: str) -> date:
+    """First day of the bucket holding `day`; weeks start on Monday"""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def bucket_count(start: date, end: date, granularity: str) -> int:
+    return (end - bucket_start(start, granularity)).days // GRANULARITIES[granularity] + 1
+
+
+def trends(db: Session, user_id: int, granularity: str, start: date, end: date) -> dict:
+    """Saves per platform and tag, and reminder completion, per day or week
+
+    Read from the rollups only. Every bucket from the one holding `start`
+    through the one holding `end` is listed, empty ones included.
+    """
+    first = bucket_start(start, granularity)
+    step = timedelta(days=GRANULARITIES[granularity])
+    buckets = {}
+    current = first
+    while current <= end:
+        buckets[current] = {
+            "start": current,
+            "saves": 0,
+            "platforms": {platform.value: 0 for platform in PlatformEnum},
+            "tags": Counter(),
+            "reminders_due": 0,
+            "reminders_completed": 0,
+        }
+        current += step
+
+    for day, platform, tag, saves in db.execute(
+        select(PostDailyRollup.day, PostDailyRollup.platform, PostDailyRollup.tag, PostDailyRollup.saves)
+        .where(PostDailyRollup.user_id == user_id, PostDailyRollup.day >= first, PostDailyRollup.day <= end)
+    ):
+        bucket = buckets[bucket_start(day, granularity)]
+        if tag == ALL_POSTS:
+            bucket["saves"] += saves
+            bucket["platforms"][platform.value] += saves
+        else:
+            bucket["tags"][tag] += saves
+
+    for day, due, completed in db.execute(
+        select(ReminderDailyRollup.day, ReminderDailyRollup.due, ReminderDailyRollup.completed)
+        .where(ReminderDailyRollup.user_id == user_id, ReminderDailyRollup.day >= first, ReminderDailyRollup.day <= end)
+    ):
+        bucket = buckets[bucket_start(day, granularity)]
+        bucket["reminders_due"] += due
+        bucket["reminders_completed"] += completed
+
+    for bucket in buckets.values():
+        bucket["tags"] = {tag: count for tag, count in sorted(bucket["tags"].items()) if count}
+        due = bucket["reminders_due"]
+        bucket["completion_rate"] = round(bucket["reminders_completed"] / due, 4) if due else None
+    return {"granularity": granularity, "from": first, "to": end, "buckets": list(buckets.values())}
+
+
+# Verification
+
+def _bucket_rows(db: Session, model, keys: Tuple[str, ...], columns: Tuple[str, ...]) -> Dict[tuple, tuple]:
+    rows = db.execute(select(*(getattr(model, name) for name in keys + columns))).all()
+    return {
+        tuple(row[:len(keys)]): tuple(row[len(keys):])
+        for row in rows if any(row[len(keys):])
+    }
+
+
+def verify(db: Session) -> List[str]:
+    """Describe every bucket that differs from a full recount of the counted rows"""
+    posts_watermark = _watermark(db, POSTS_WATERMARK)
+    reminders_watermark = _watermark(db, REMINDERS_WATERMARK)
+    stored_posts = _bucket_rows(db, PostDailyRollup, POST_KEYS, ("saves",))
+    stored_reminders = _bucket_rows(db, ReminderDailyRollup, REMINDER_KEYS, ("due", "completed"))
+
+    # Recount in place inside a transaction that is rolled back afterwards
+    db.execute(delete(PostDailyRollup))
+    db.execute(delete(ReminderDailyRollup))
+    _fold_posts(db, 0, posts_watermark)
+    _fold_reminders(db, 0, reminders_watermark)
+    actual_posts = _bucket_rows(db, PostDailyRollup, POST_KEYS, ("saves",))
+    actual_reminders = _bucket_rows(db, ReminderDailyRollup, REMINDER_KEYS, ("due", "completed"))
+    db.rollback()
+
+    drift = []
+    for name, stored, actual in (("posts", stored_posts, actual_posts), ("reminders", stored_reminders, actual_reminders)):
+        for key in sorted(set(stored) | set(actual), key=str):
+            if stored.get(key) != actual.get(key):
+                drift.append(f"{name} {key}: stored {stored.get(key)}, actual {actual.get(key)}")
+    return drift
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Maintain the daily rollups behind /analytics/trends")
+    parser.add_argument("command", choices=["catch-up", "rebuild", "verify"])
+    parser.add_argument("--batch-size", type=int, default=ROLLUP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if args.command == "verify":
+            drift = verify(db)
+            for line in drift:
+                print(line)
+            if drift:
+                print(f"{len(drift)} bucket(s) have drifted; run `python rollups.py rebuild`")
+                sys.exit(1)
+            print("Rollups match the source tables")
+        else:
+            step = catch_up if args.command == "catch-up" else rebuild
+            watermarks = step(db, args.batch_size)
+            print(
+                f"Rollups cover saved_posts through id {watermarks['saved_posts']} "
+                f"and reminders through id {watermarks['reminders']}"
+            )
+    finally:
+        db.close()
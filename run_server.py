@@ -24,8 +24,9 @@ def run_server():
 
 if __name__ == "__main__":
     try:
-        # Install requirements
-        install_requirements()
+        # Install requirements only when asked; production uses serve.py
+        if "--install" in sys.argv[1:]:
+            install_requirements()
         
         # Seed database
         seed_database()
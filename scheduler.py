@@ -0,0 +1,340 @@
+import asyncio
+import bisect
+import heapq
+import importlib
+import json
+import logging
+import os
+import signal
+import urllib.request
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import AsyncSessionLocal, SessionLocal
+from models import Reminder
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+# "log" (default), "none", an http(s):// webhook URL, or "package.module:ClassName"
+SCHEDULER_NOTIFIER = os.getenv("SCHEDULER_NOTIFIER", "log")
+# Longest the dispatcher sleeps without being woken by a new reminder
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", "60"))
+SCHEDULER_LOAD_BATCH = int(os.getenv("SCHEDULER_LOAD_BATCH", "5000"))
+WEBHOOK_TIMEOUT = float(os.getenv("SCHEDULER_WEBHOOK_TIMEOUT", "5"))
+
+logger = logging.getLogger("stash.scheduler")
+
+
+@dataclass
+class ScheduledReminder:
+    """In-memory copy of a pending reminder, enough to answer /reminders/upcoming"""
+    id: int
+    user_id: int
+    title: str
+    description: str
+    due_date: datetime
+    is_urgent: bool
+    created_at: datetime
+    is_completed: bool = False
+
+    @classmethod
+    def from_row(cls, row) -> "ScheduledReminder":
+        return cls(
+            id=row.id, user_id=row.user_id, title=row.title, description=row.description,
+            due_date=row.due_date, is_urgent=bool(row.is_urgent), created_at=row.created_at
+        )
+
+    def payload(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "title": self.title,
+            "description": self.description,
+            "due_date": self.due_date.isoformat(),
+            "is_urgent": self.is_urgent,
+        }
+
+
+class Notifier(ABC):
+    """Delivers fired reminders; subclasses implement notify"""
+
+    @abstractmethod
+    async def notify(self, reminders: List[ScheduledReminder]) -> None:
+        ...
+
+
+class NullNotifier(Notifier):
+    async def notify(self, reminders: List[ScheduledReminder]) -> None:
+        pass
+
+
+class LogNotifier(Notifier):
+    """Local stand-in that writes each fired reminder to the log"""
+
+    async def notify(self, reminders: List[ScheduledReminder]) -> None:
+        for reminder in reminders:
+            logger.warning(
+                "Reminder %s for user %s is due (%s): %s",
+                reminder.id, reminder.user_id, reminder.due_date.isoformat(), reminder.title
+            )
+
+
+class WebhookNotifier(Notifier):
+    """POSTs {"reminders": [...]} as JSON to a URL"""
+
+    def __init__(self, url: str, timeout: float = WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    async def notify(self, reminders: List[ScheduledReminder]) -> None:
+        body = json.dumps({"reminders": [reminder.payload() for reminder in reminders]}).encode()
+        request = urllib.request.Request(
+            self.url, data=body, method="POST", headers={"Content-Type": "application/json"}
+        )
+        await asyncio.to_thread(self._send, request)
+
+    def _send(self, request: urllib.request.Request) -> None:
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def load_notifier(name: str = SCHEDULER_NOTIFIER) -> Notifier:
+    if name == "none":
+        return NullNotifier()
+    if name == "log":
+        return LogNotifier()
+    if name.startswith(("http://", "https://")):
+        return WebhookNotifier(name)
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown SCHEDULER_NOTIFIER '{name}'")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+def load_pending(
+    db: Session, batch_size: int = SCHEDULER_LOAD_BATCH, until: Optional[datetime] = None
+) -> List[ScheduledReminder]:
+    """Every open, not yet notified reminder (due by `until`, if given); served by the (is_completed, due_date) index"""
+    query = select(
+        Reminder.id, Reminder.user_id, Reminder.title, Reminder.description,
+        Reminder.due_date, Reminder.is_urgent, Reminder.created_at
+    ).where(
+        Reminder.is_completed == False,
+        Reminder.due_date.is_not(None),
+        Reminder.notified_at.is_(None),
+    )
+    if until is not None:
+        query = query.where(Reminder.due_date <= until)
+    result = db.execute(query.order_by(Reminder.due_date).execution_options(yield_per=batch_size))
+    return [ScheduledReminder.from_row(row) for row in result]
+
+
+class ReminderScheduler:
+    """Min-heap of pending reminders plus per-user due-date lists
+
+    The heap decides what fires next; stale heap entries (rescheduled or
+    removed reminders) are skipped when popped. Per-user lists stay sorted by
+    (due_date, id) so upcoming windows are answered with two bisects.
+
+    Endpoint hooks only reach the scheduler of their own process, so run it in
+    exactly one process. Behind several workers, run `python scheduler.py`
+    instead: it polls the database for reminders coming due and the workers
+    answer /reminders/upcoming from the database.
+    """
+
+    def __init__(self, session_factory: Callable[[], AsyncSession], notifier: Optional[Notifier] = None):
+        self.session_factory = session_factory
+        self.notifier = notifier or load_notifier()
+        self.pending: Dict[int, ScheduledReminder] = {}
+        self.heap: List[Tuple[datetime, int]] = []
+        self.by_user: Dict[int, List[Tuple[datetime, int]]] = {}
+        self.running = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._poll: Optional[Callable[[datetime], List[ScheduledReminder]]] = None
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def load(self, reminders: List[ScheduledReminder]) -> None:
+        self.pending.clear()
+        self.by_user.clear()
+        for reminder in reminders:
+            self.pending[reminder.id] = reminder
+            self.by_user.setdefault(reminder.user_id, []).append((reminder.due_date, reminder.id))
+        for entries in self.by_user.values():
+            entries.sort()
+        self.heap = [(reminder.due_date, reminder.id) for reminder in reminders]
+        heapq.heapify(self.heap)
+
+    def schedule(self, reminder) -> None:
+        """Add, move or drop a reminder after a committed write"""
+        self.unschedule(reminder.id)
+        if not self.running or reminder.is_completed or reminder.due_date is None or reminder.notified_at is not None:
+            return
+        entry = ScheduledReminder.from_row(reminder)
+        self.pending[entry.id] = entry
+        bisect.insort(self.by_user.setdefault(entry.user_id, []), (entry.due_date, entry.id))
+        if not self.heap or (entry.due_date, entry.id) < self.heap[0]:
+            # New earliest reminder; cut the dispatcher's sleep short
+            self._wakeup.set()
+        heapq.heappush(self.heap, (entry.due_date, entry.id))
+        if len(self.heap) > 2 * len(self.pending) + 1000:
+            # Too many stale entries from rescheduling; rebuild from the live set
+            self.heap = [(reminder.due_date, reminder.id) for reminder in self.pending.values()]
+            heapq.heapify(self.heap)
+
+    def unschedule(self, reminder_id: int) -> None:
+        entry = self.pending.pop(reminder_id, None)
+        if entry is None:
+            return
+        entries = self.by_user.get(entry.user_id)
+        if entries:
+            position = bisect.bisect_left(entries, (entry.due_date, entry.id))
+            if position < len(entries) and entries[position] == (entry.due_date, entry.id):
+                del entries[position]
+            if not entries:
+                del self.by_user[entry.user_id]
+        # The heap entry is left behind and skipped when it surfaces
+
+    def upcoming(self, user_id: int, within: timedelta, now: Optional[datetime] = None) -> List[ScheduledReminder]:
+        now = now or datetime.utcnow()
+        entries = self.by_user.get(user_id, [])
+        start = bisect.bisect_right(entries, (now, float("inf")))
+        end = bisect.bisect_right(entries, (now + within, float("inf")))
+        return [self.pending[reminder_id] for _, reminder_id in entries[start:end]]
+
+    def pop_due(self, now: datetime) -> List[ScheduledReminder]:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due_date, reminder_id = heapq.heappop(self.heap)
+            entry = self.pending.get(reminder_id)
+            if entry is None or entry.due_date != due_date:
+                continue
+            self.unschedule(reminder_id)
+            due.append(entry)
+        return due
+
+    def next_due(self) -> Optional[datetime]:
+        # Drop stale entries so the sleep is computed from a live reminder
+        while self.heap:
+            due_date, reminder_id = self.heap[0]
+            entry = self.pending.get(reminder_id)
+            if entry is not None and entry.due_date == due_date:
+                return due_date
+            heapq.heappop(self.heap)
+        return None
+
+    async def fire(self, reminders: List[ScheduledReminder]) -> List[ScheduledReminder]:
+        """Claim reminders in the database and notify those this process won
+
+        The claim only succeeds while notified_at is still NULL, so with several
+        workers each reminder is delivered once, and only while the stored due
+        date has passed, so a reminder moved later elsewhere waits for it.
+        """
+        ids = [reminder.id for reminder in reminders]
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            claimed = set((await db.execute(
+                update(Reminder)
+                .where(
+                    Reminder.id.in_(ids), Reminder.notified_at.is_(None),
+                    Reminder.is_completed == False, Reminder.due_date <= now
+                )
+                .values(notified_at=now)
+                .returning(Reminder.id)
+            )).scalars())
+            await db.commit()
+        won = [reminder for reminder in reminders if reminder.id in claimed]
+        if won:
+            try:
+                await self.notifier.notify(won)
+            except Exception:
+                logger.exception("Notifier failed for reminders %s", [reminder.id for reminder in won])
+        return won
+
+    async def run(self) -> None:
+        while self.running:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+            if self._poll is not None:
+                # Writes happen in other processes; take the next window from the database
+                try:
+                    self.load(await asyncio.to_thread(self._poll, now + timedelta(seconds=SCHEDULER_MAX_SLEEP)))
+                except Exception:
+                    logger.exception("Could not load pending reminders")
+            due = self.pop_due(now)
+            if due:
+                try:
+                    await self.fire(due)
+                except Exception:
+                    logger.exception("Could not dispatch %d due reminders", len(due))
+                continue
+
+            next_due = self.next_due()
+            timeout = SCHEDULER_MAX_SLEEP
+            if next_due is not None:
+                timeout = min(timeout, max((next_due - now).total_seconds(), 0.0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(
+        self,
+        load: Callable[[], List[ScheduledReminder]],
+        poll: Optional[Callable[[datetime], List[ScheduledReminder]]] = None,
+    ) -> None:
+        """Load pending reminders and start dispatching; overdue ones fire right away
+
+        With `poll`, the reminders due before each wakeup are reloaded through it
+        every SCHEDULER_MAX_SLEEP seconds rather than kept current by endpoint hooks.
+        """
+        self.load(await asyncio.to_thread(load))
+        self._poll = poll
+        self.running = True
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self.running = False
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+
+scheduler = ReminderScheduler(AsyncSessionLocal)
+
+
+def load_pending_reminders(until: Optional[datetime] = None) -> List[ScheduledReminder]:
+    db = SessionLocal()
+    try:
+        return load_pending(db, until=until)
+    finally:
+        db.close()
+
+
+async def run_standalone() -> None:
+    """Dispatch reminders from this process alone until SIGINT or SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await scheduler.start(
+        lambda: load_pending_reminders(datetime.utcnow() + timedelta(seconds=SCHEDULER_MAX_SLEEP)),
+        poll=load_pending_reminders,
+    )
+    logger.info("Dispatching reminders; polling every %ss", SCHEDULER_MAX_SLEEP)
+    await stop.wait()
+    await scheduler.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "info").upper())
+    asyncio.run(run_standalone())
@@ -11,6 +11,11 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     pass
 
+class UserUpdate(BaseModel):
+    email: Optional[str] = None
+    name: Optional[str] = None
+    is_active: Optional[bool] = None
+
 class User(UserBase):
     id: int
     created_at: datetime
@@ -19,6 +24,10 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserWithToken(User):
+    # Returned once at sign-up; only its hash is stored
+    api_token: str
+
 # SavedPost schemas
 class SavedPostBase(BaseModel):
     platform: PlatformEnum
@@ -67,6 +76,9 @@ class Reminder(ReminderBase):
     class Config:
         from_attributes = True
 
+class ReminderBatchResponse(BaseModel):
+    affected: int
+
 # ChatMessage schemas
 class ChatMessageBase(BaseModel):
     message: str
@@ -86,8 +98,30 @@ class ChatMessage(ChatMessageBase):
 # Response schemas
 class SavedPostsResponse(BaseModel):
     posts: List[SavedPost]
-    total: int
+    total: Optional[int] = None
     stats: dict
+    next_cursor: Optional[str] = None
+
+class BulkRowResult(BaseModel):
+    index: int
+    status: str
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkIngestResponse(BaseModel):
+    created: int
+    # Rows whose URL was already saved; their tags were added to that post
+    merged: int = 0
+    failed: int
+    results: List[BulkRowResult]
+
+class SearchResult(SavedPost):
+    rank: float
+    snippet: str
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
 
 class ChatResponse(BaseModel):
     message: str
@@ -0,0 +1,90 @@
+import re
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text, column, Float, String
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import SavedPost
+from pagination import encode_cursor, decode_cursor
+from tags import load_tags
+
+# Column weights for bm25(): title matches count most, then tags, then summary
+BM25_WEIGHTS = "10.0, 2.0, 5.0"
+
+SEARCH_SQL = f"""
+    SELECT p.id, p.user_id, p.platform, p.title, p.summary, p.tags, p.saved_at,
+           p.has_deadline, p.deadline, p.ai_detected, p.original_url,
+           bm25(saved_posts_fts, {BM25_WEIGHTS}) AS rank,
+           snippet(saved_posts_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet
+    FROM saved_posts_fts
+    JOIN saved_posts AS p ON p.id = saved_posts_fts.rowid
+    WHERE saved_posts_fts MATCH :match
+      AND p.user_id = :user_id
+      {{seek}}
+    ORDER BY rank, p.id
+    LIMIT :limit
+"""
+
+SEEK_SQL = f"""
+      AND (bm25(saved_posts_fts, {BM25_WEIGHTS}) > :after_rank
+           OR (bm25(saved_posts_fts, {BM25_WEIGHTS}) = :after_rank AND p.id > :after_id))
+"""
+
+# Typed result columns so platform and dates load like ORM attributes
+RESULT_COLUMNS = [
+    *(SavedPost.__table__.c[name] for name in (
+        "id", "user_id", "platform", "title", "summary", "tags", "saved_at",
+        "has_deadline", "deadline", "ai_detected", "original_url",
+    )),
+    column("rank", Float),
+    column("snippet", String),
+]
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix"""
+    tokens = TOKEN_PATTERN.findall(q)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_posts(
+    db: Session, user_id: int, q: str, limit: int, after: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """BM25-ranked posts of the user matching q, with a cursor for the next page"""
+    match = build_match_query(q)
+    if match is None:
+        return [], None
+
+    params = {"match": match, "user_id": user_id, "limit": limit}
+    seek = ""
+    if after:
+        after_rank, after_id = decode_cursor(after, 2)
+        if not isinstance(after_rank, (int, float)) or not isinstance(after_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        params.update(after_rank=after_rank, after_id=after_id)
+        seek = SEEK_SQL
+
+    try:
+        statement = text(SEARCH_SQL.format(seek=seek)).columns(*RESULT_COLUMNS)
+        rows = db.execute(statement, params).mappings().all()
+    except OperationalError:
+        raise HTTPException(status_code=501, detail="Full-text search is not available on this database")
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result["tags"] = load_tags(row["tags"])
+        results.append(result)
+
+    next_cursor = None
+    if results and len(results) == limit:
+        next_cursor = encode_cursor([results[-1]["rank"], results[-1]["id"]])
+    return results, next_cursor
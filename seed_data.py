@@ -1,6 +1,9 @@
 from sqlalchemy.orm import Session
 from database import SessionLocal, create_tables
-from models import User, SavedPost, Reminder, ChatMessage, PlatformEnum
+from models import User, SavedPost, PostTag, Reminder, ChatMessage, PlatformEnum
+from tags import load_tags
+from stats import rebuild_user_stats
+from auth import issue_token, AUTH_DEMO_EMAIL
 import json
 from datetime import datetime, timedelta
 
@@ -16,7 +19,7 @@ def seed_database():
         
         # Create demo user
         user = User(
-            email="demo@stashapp.com",
+            email=AUTH_DEMO_EMAIL,
             name="Demo User"
         )
         db.add(user)
@@ -73,6 +76,7 @@ def seed_database():
         
         for post_data in sample_posts:
             post = SavedPost(user_id=user.id, **post_data)
+            post.tag_rows = [PostTag(user_id=user.id, tag=tag) for tag in load_tags(post_data["tags"])]
             db.add(post)
         
         # Create sample reminders
@@ -130,9 +134,13 @@ def seed_database():
             message = ChatMessage(user_id=user.id, **msg_data)
             db.add(message)
         
+        db.flush()
+        rebuild_user_stats(db, user.id)
+        token = issue_token(db, user.id)
         db.commit()
         print("Database seeded successfully!")
         print(f"Created user: {user.email}")
+        print(f"API token: {token}")
         print(f"Created {len(sample_posts)} saved posts")
         print(f"Created {len(sample_reminders)} reminders")
         print(f"Created {len(sample_messages)} chat messages")
@@ -0,0 +1,72 @@
+import enum
+import json
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Sequence
+
+import metrics
+from tags import load_tags
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Columns stored as JSON strings that responses return decoded
+JSON_STRING_FIELDS = {"tags"}
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Compact JSON; orjson when installed, the standard library otherwise
+
+    Both handle datetimes (ISO 8601) and enums (their value) the way
+    FastAPI's jsonable_encoder does, so switching never changes a payload.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class FastJSONResponse(metrics.TimedJSONResponse):
+    """Response for payloads that are already plain dicts, lists and scalars"""
+
+    def render(self, content) -> bytes:
+        with metrics.serializing():
+            return dumps(content)
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Columns named by ?fields=, in the schema's order; every field when not given"""
+    if not fields:
+        return list(allowed)
+    wanted = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(wanted - set(allowed))
+    if unknown or not wanted:
+        raise ValueError(f"fields must be a comma-separated subset of {', '.join(allowed)}")
+    return [name for name in allowed if name in wanted]
+
+
+def columns(model, fields: Sequence[str], always: Sequence[str] = ()) -> list:
+    """Table columns for the requested fields, plus any the query itself needs"""
+    names = list(fields) + [name for name in always if name not in fields]
+    return [model.__table__.c[name] for name in names]
+
+
+def rows_to_dicts(rows: Iterable, fields: Sequence[str]) -> List[dict]:
+    """Plain dicts from result rows, decoding JSON string columns"""
+    decoded = [name for name in fields if name in JSON_STRING_FIELDS]
+    items = []
+    for row in rows:
+        mapping = row._mapping
+        item = {name: mapping[name] for name in fields}
+        for name in decoded:
+            item[name] = load_tags(item[name])
+        items.append(item)
+    return items
@@ -0,0 +1,220 @@
+"""Production entry point
+
+Migrates (and optionally seeds) the database and runs any pending
+reclassification once, then starts several worker processes that skip both
+on boot:
+
+    python serve.py --workers 4
+    RESPONSE_CACHE_URL=redis://localhost:6379/0 python serve.py --server gunicorn --workers 8 --seed
+
+With more than one worker, process-local state is kept out of the workers:
+the response cache is turned off unless RESPONSE_CACHE_URL points at a
+shared redis, cached identities live at most AUTH_CACHE_TTL_SHARED seconds
+(a deactivation or profile change made through one worker reaches the others
+within that time), and reminders are dispatched by a single
+`python scheduler.py` process started alongside them (--external-scheduler
+if you run it yourself).
+
+That scheduler process polls: it cannot see the workers' writes, so every
+SCHEDULER_MAX_SLEEP seconds (default 60) it reads the reminders coming due
+in the next window from the (is_completed, due_date) index. A reminder
+created or moved through a worker to a time before the next poll fires up to
+SCHEDULER_MAX_SLEEP seconds late. With --workers 1 the scheduler runs inside
+the worker and is woken by writes instead.
+
+uvloop and httptools are used when installed; gunicorn is needed only for
+--server gunicorn.
+"""
+import argparse
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+import subprocess
+import sys
+
+
+# Response cache URLs every worker shares; see cache.create_backend
+SHARED_CACHE_SCHEMES = ("redis://", "rediss://", "unix://")
+# Identity cache TTL with several workers, since invalidation stays in-process
+AUTH_CACHE_TTL_SHARED = float(os.getenv("AUTH_CACHE_TTL_SHARED", "5"))
+
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def prepare_database(migrate: bool, seed: bool, reclassify: bool) -> None:
+    """Run migrations, the demo seed and reclassification once, before any worker exists"""
+    import rollups
+    from database import SessionLocal, create_tables
+
+    if migrate:
+        create_tables()
+    if seed:
+        from seed_data import seed_database
+        seed_database()
+    # Fold rows imported since the last boot into the trend rollups
+    db = SessionLocal()
+    try:
+        rollups.catch_up(db)
+    finally:
+        db.close()
+    if reclassify:
+        reclassify_posts()
+
+
+def reclassify_posts() -> None:
+    """Re-score ai_detected here when the rules changed, instead of once per worker"""
+    import cache
+    import classifier
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        outdated = classifier.needs_reclassify(db)
+    finally:
+        db.close()
+    if not outdated:
+        return
+
+    changed_users = set()
+    changed = classifier.reclassify_posts(SessionLocal, on_change=changed_users.update)
+    print(f"Re-scored posts with rules {classifier.default_classifier.fingerprint}; {changed} changed")
+
+    # A shared cache outlives this boot; drop bodies that still carry the old flags
+    async def invalidate():
+        for user_id in changed_users:
+            await cache.bump(user_id)
+    asyncio.run(invalidate())
+
+
+def run_prepare(migrate: bool, seed: bool, reclassify: bool) -> None:
+    # A spawned child, so forked workers inherit no pooled connections or clients from it
+    process = multiprocessing.get_context("spawn").Process(
+        target=prepare_database, args=(migrate, seed, reclassify)
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise SystemExit(f"Preparing the database failed (exit code {process.exitcode})")
+
+
+def configure_workers(args: argparse.Namespace) -> bool:
+    """Set the environment every worker boots with; True if this launcher must run the scheduler"""
+    # Migrations and reclassification run once in run_prepare; workers only serve
+    os.environ["RUN_MIGRATIONS_ON_STARTUP"] = "0"
+    os.environ["CLASSIFIER_AUTO_RECLASSIFY"] = "0"
+    if args.workers <= 1:
+        return False
+
+    # Per-process version counters would let workers serve each other's stale bodies
+    cache_url = os.getenv("RESPONSE_CACHE_URL", "memory")
+    if cache_url != "none" and not cache_url.startswith(SHARED_CACHE_SCHEMES):
+        print(
+            f"RESPONSE_CACHE_URL={cache_url} is per process; the response cache is off with "
+            f"{args.workers} workers. Point it at redis to keep it.",
+            file=sys.stderr,
+        )
+        os.environ["RESPONSE_CACHE_URL"] = "none"
+
+    # Identity invalidation is per process too; keep other workers' copies short-lived
+    auth_ttl = float(os.getenv("AUTH_CACHE_TTL", "300"))
+    os.environ["AUTH_CACHE_TTL"] = str(min(auth_ttl, AUTH_CACHE_TTL_SHARED))
+
+    # Endpoint hooks only reach their own worker's scheduler, so none of them runs one
+    run_scheduler = os.getenv("SCHEDULER_ENABLED", "1") == "1" and not args.external_scheduler
+    os.environ["SCHEDULER_ENABLED"] = "0"
+    return run_scheduler
+
+
+def start_scheduler() -> subprocess.Popen:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scheduler.py")
+    return subprocess.Popen([sys.executable, script])
+
+
+def serve_uvicorn(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if available("uvloop") else "asyncio",
+        http="httptools" if available("httptools") else "h11",
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+        log_level=args.log_level,
+        proxy_headers=True,
+        access_log=args.access_log,
+    )
+
+
+def serve_gunicorn(args: argparse.Namespace) -> None:
+    if not available("gunicorn"):
+        raise SystemExit("--server gunicorn needs the gunicorn package: pip install gunicorn")
+    from gunicorn.app.base import BaseApplication
+
+    class StashApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "graceful_timeout": args.graceful_timeout,
+                "keepalive": args.keep_alive,
+                "loglevel": args.log_level,
+                "accesslog": "-" if args.access_log else None,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    StashApplication().run()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run the Stash API with several worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+        help="worker processes (default: WEB_CONCURRENCY or the CPU count); with more than one, "
+             "reminders are dispatched by a scheduler process that polls the database every "
+             "SCHEDULER_MAX_SLEEP seconds"
+    )
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default=os.getenv("SERVER", "uvicorn"))
+    parser.add_argument("--seed", action="store_true", help="load the demo data if the database is empty")
+    parser.add_argument("--skip-migrations", action="store_true", help="assume the schema is already current")
+    parser.add_argument(
+        "--external-scheduler", action="store_true",
+        help="with several workers, do not start the polling `python scheduler.py`; exactly one must run elsewhere"
+    )
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="seconds to finish in-flight requests")
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument("--access-log", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+
+    reclassify = os.getenv("CLASSIFIER_AUTO_RECLASSIFY", "1") == "1"
+    run_scheduler = configure_workers(args)
+    run_prepare(not args.skip_migrations, args.seed, reclassify)
+
+    scheduler_process = start_scheduler() if run_scheduler else None
+    try:
+        if args.server == "gunicorn":
+            serve_gunicorn(args)
+        else:
+            serve_uvicorn(args)
+    finally:
+        if scheduler_process is not None:
+            scheduler_process.terminate()
+            scheduler_process.wait()
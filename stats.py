@@ -0,0 +1,226 @@
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+
+import analytics
+from models import User, UserStats, UserTagStats, PlatformEnum
+
+# user_stats column holding the post count of each platform
+PLATFORM_COLUMNS = {platform: f"{platform.value}_posts" for platform in PlatformEnum}
+
+COUNTER_COLUMNS = [
+    "total_posts", "ai_detected_posts", *PLATFORM_COLUMNS.values(),
+    "active_reminders", "completed_reminders",
+]
+
+# (platform, tags, ai_detected) of a post being added or removed
+PostFacts = Tuple[PlatformEnum, Iterable[str], bool]
+
+
+def init_user_stats(db: Session, user_id: int) -> None:
+    """Add the zeroed counter row of a newly created user"""
+    db.add(UserStats(user_id=user_id, **{column: 0 for column in COUNTER_COLUMNS}))
+
+
+def _bump(db: Session, user_id: int, deltas: Dict[str, int]) -> None:
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    values = {column: getattr(UserStats, column) + delta for column, delta in deltas.items()}
+    result = db.execute(update(UserStats).where(UserStats.user_id == user_id).values(values))
+    if result.rowcount == 0:
+        # Users created before user_stats existed are filled in by
+        # backfill_user_stats; a missing row here is drift for `verify`
+        db.add(UserStats(user_id=user_id, **{
+            column: max(deltas.get(column, 0), 0) for column in COUNTER_COLUMNS
+        }))
+        db.flush()
+
+
+def _bump_tags(db: Session, user_id: int, tag_deltas: Dict[str, int]) -> None:
+    for tag, delta in tag_deltas.items():
+        if not delta:
+            continue
+        result = db.execute(
+            update(UserTagStats)
+            .where(UserTagStats.user_id == user_id, UserTagStats.tag == tag)
+            .values(post_count=UserTagStats.post_count + delta)
+        )
+        if result.rowcount == 0 and delta > 0:
+            db.add(UserTagStats(user_id=user_id, tag=tag, post_count=delta))
+            db.flush()
+
+    if any(delta < 0 for delta in tag_deltas.values()):
+        db.execute(delete(UserTagStats).where(
+            UserTagStats.user_id == user_id,
+            UserTagStats.post_count <= 0
+        ))
+
+
+def record_posts(db: Session, user_id: int, posts: Iterable[PostFacts], sign: int = 1) -> None:
+    """Count posts in (sign=1) or out of (sign=-1) the user's counters; the caller commits"""
+    deltas: Counter = Counter()
+    tag_deltas: Counter = Counter()
+    for platform, tags, ai_detected in posts:
+        deltas["total_posts"] += sign
+        deltas[PLATFORM_COLUMNS[platform]] += sign
+        if ai_detected:
+            deltas["ai_detected_posts"] += sign
+        for tag in tags:
+            tag_deltas[tag] += sign
+
+    _bump(db, user_id, deltas)
+    _bump_tags(db, user_id, tag_deltas)
+
+
+def record_tags(db: Session, user_id: int, tag_deltas: Dict[str, int]) -> None:
+    """Adjust per-tag counts when existing posts gain or lose tags; the caller commits"""
+    _bump_tags(db, user_id, tag_deltas)
+
+
+def record_reminders(db: Session, user_id: int, active: int = 0, completed: int = 0) -> None:
+    """Adjust the user's reminder counters; the caller commits"""
+    _bump(db, user_id, {"active_reminders": active, "completed_reminders": completed})
+
+
+def record_ai_detected(db: Session, user_id: int, delta: int) -> None:
+    """Adjust the ai_detected count after posts are re-scored; the caller commits"""
+    _bump(db, user_id, {"ai_detected_posts": delta})
+
+
+def get_user_stats(db: Session, user_id: int) -> Dict[str, int]:
+    """The user's counters as a plain dict, zeroed if the row does not exist"""
+    row = db.execute(
+        select(*[getattr(UserStats, column) for column in COUNTER_COLUMNS])
+        .where(UserStats.user_id == user_id)
+    ).one_or_none()
+    if row is None:
+        return {column: 0 for column in COUNTER_COLUMNS}
+    return dict(row._mapping)
+
+
+def get_tag_counts(db: Session, user_id: int) -> Dict[str, int]:
+    return dict(db.execute(
+        select(UserTagStats.tag, UserTagStats.post_count)
+        .where(UserTagStats.user_id == user_id)
+        .order_by(UserTagStats.tag)
+    ).all())
+
+
+def get_tag_count(db: Session, user_id: int, tag: str) -> int:
+    count = db.execute(
+        select(UserTagStats.post_count)
+        .where(UserTagStats.user_id == user_id, UserTagStats.tag == tag)
+    ).scalar()
+    return count or 0
+
+
+def compute_user_stats(db: Session, user_id: int) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Count a user's posts and reminders from the source tables"""
+    posts = analytics.post_aggregates(db, user_id)
+    reminders = analytics.reminder_aggregates(db, user_id)
+    counters = {
+        "total_posts": posts["total_posts"],
+        "ai_detected_posts": posts["ai_detected_posts"],
+        "active_reminders": reminders["active_reminders"],
+        "completed_reminders": reminders["completed_reminders"],
+    }
+    for platform, column in PLATFORM_COLUMNS.items():
+        counters[column] = posts["posts_by_platform"][platform.value]
+    return counters, analytics.tag_aggregates(db, user_id)
+
+
+def rebuild_user_stats(db: Session, user_id: int) -> None:
+    """Replace the user's counters with freshly computed values; the caller commits"""
+    counters, tag_counts = compute_user_stats(db, user_id)
+
+    stats = db.get(UserStats, user_id)
+    if stats is None:
+        stats = UserStats(user_id=user_id)
+        db.add(stats)
+    for column, value in counters.items():
+        setattr(stats, column, value)
+
+    db.execute(delete(UserTagStats).where(UserTagStats.user_id == user_id))
+    db.add_all(
+        UserTagStats(user_id=user_id, tag=tag, post_count=count)
+        for tag, count in tag_counts.items()
+    )
+    db.flush()
+
+
+def verify_user_stats(db: Session, user_id: int) -> List[str]:
+    """Describe every counter of the user that differs from the source tables"""
+    counters, tag_counts = compute_user_stats(db, user_id)
+    stored = db.get(UserStats, user_id)
+    if stored is None:
+        return ["missing user_stats row"]
+
+    drift = [
+        f"{column}: stored {getattr(stored, column)}, actual {value}"
+        for column, value in counters.items()
+        if getattr(stored, column) != value
+    ]
+    stored_tags = get_tag_counts(db, user_id)
+    for tag in sorted(set(stored_tags) | set(tag_counts)):
+        if stored_tags.get(tag, 0) != tag_counts.get(tag, 0):
+            drift.append(f"tag {tag!r}: stored {stored_tags.get(tag, 0)}, actual {tag_counts.get(tag, 0)}")
+    return drift
+
+
+def backfill_user_stats(db: Session) -> int:
+    """Build counters for users that do not have a user_stats row yet"""
+    user_ids = db.execute(
+        select(User.id).where(~select(UserStats.user_id).where(UserStats.user_id == User.id).exists())
+    ).scalars().all()
+    for user_id in user_ids:
+        rebuild_user_stats(db, user_id)
+        db.commit()
+    return len(user_ids)
+
+
+def _user_ids(db: Session, user_id: Optional[int]) -> List[int]:
+    if user_id is not None:
+        return [user_id]
+    return db.execute(select(User.id).order_by(User.id)).scalars().all()
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify the per-user counters in user_stats")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        drifted = 0
+        for user_id in _user_ids(db, args.user_id):
+            if args.command == "rebuild":
+                rebuild_user_stats(db, user_id)
+                db.commit()
+                continue
+
+            drift = verify_user_stats(db, user_id)
+            if drift:
+                drifted += 1
+                print(f"user {user_id}:")
+                for line in drift:
+                    print(f"  {line}")
+
+        if args.command == "rebuild":
+            print("User stats rebuilt")
+        elif drifted:
+            print(f"{drifted} user(s) have drifted counters; run `python stats.py rebuild`")
+            sys.exit(1)
+        else:
+            print("User stats match the source tables")
+    finally:
+        db.close()
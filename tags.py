@@ -0,0 +1,18 @@
+import json
+from typing import Iterable, List, Optional
+
+
+def unique_tags(tags: Iterable[str]) -> List[str]:
+    """Drop blank and repeated tags, keeping the original order"""
+    return list(dict.fromkeys(tag.strip() for tag in tags if tag and tag.strip()))
+
+
+def load_tags(raw: Optional[str]) -> List[str]:
+    """Parse the JSON tag string stored on SavedPost.tags"""
+    if not raw:
+        return []
+    try:
+        tags = json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError:
+        return []
+    return [tag for tag in tags if isinstance(tag, str)] if isinstance(tags, list) else []